@@ -4,363 +4,331 @@ Generate explanation_local.pdf from existing HTML patient reports.
 This script converts HTML patient reports to PDF format for the assignment deliverable.
 """
 
+import base64
+import gc
 import os
+import re
 import sys
 from pathlib import Path
 import weasyprint
 from weasyprint import HTML, CSS
 from weasyprint.text.fonts import FontConfiguration
 
-def create_combined_html(patient_reports_dir, output_html_path):
-    """
-    Combine multiple patient HTML reports into a single HTML document.
-    
-    Args:
-        patient_reports_dir (str): Directory containing patient HTML reports
-        output_html_path (str): Path where combined HTML will be saved
-    """
-    
-    # Find patient HTML reports
-    patient_htmls = []
-    for file in sorted(os.listdir(patient_reports_dir)):
-        if file.endswith('_report.html'):
-            patient_htmls.append(os.path.join(patient_reports_dir, file))
-    
-    if len(patient_htmls) < 2:
-        print(f"Error: Need at least 2 patient HTML reports. Found {len(patient_htmls)}")
-        sys.exit(1)
-    
-    # Take first two patients for the assignment
-    patient1_html = patient_htmls[0]
-    patient2_html = patient_htmls[1]
-    
-    print(f"Combining reports from:")
-    print(f"  - {patient1_html}")
-    print(f"  - {patient2_html}")
-    
-    # Read HTML content and fix image paths
-    with open(patient1_html, 'r', encoding='utf-8') as f:
-        patient1_content = f.read()
-    
-    with open(patient2_html, 'r', encoding='utf-8') as f:
-        patient2_content = f.read()
-    
-    # Fix image paths to be absolute
-    patient_reports_abs = os.path.abspath(patient_reports_dir)
-    patient1_content = patient1_content.replace('src="patient1_', f'src="{patient_reports_abs}/patient1_')
-    patient1_content = patient1_content.replace('src="patient2_', f'src="{patient_reports_abs}/patient2_')
-    patient2_content = patient2_content.replace('src="patient1_', f'src="{patient_reports_abs}/patient1_')
-    patient2_content = patient2_content.replace('src="patient2_', f'src="{patient_reports_abs}/patient2_')
-    
-    # Extract body content from each HTML (remove html, head tags)
-    def extract_body_content(html_content):
-        """Extract content between <body> tags"""
-        start_tag = '<body'
-        end_tag = '</body>'
-        
-        start_idx = html_content.find(start_tag)
-        if start_idx == -1:
-            return html_content
-        
-        # Find end of opening body tag
-        start_idx = html_content.find('>', start_idx) + 1
-        end_idx = html_content.rfind(end_tag)
-        
-        if end_idx == -1:
-            return html_content[start_idx:]
-        
-        return html_content[start_idx:end_idx]
-    
-    patient1_body = extract_body_content(patient1_content)
-    patient2_body = extract_body_content(patient2_content)
-    
-    # Create combined HTML document
-    combined_html = f"""
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+# Relative image references in the patient reports (inlined or made absolute)
+_SRC_RE = re.compile(rb'src="(patient[12]_[^"]*)"')
+
+# Self-hosted subset of Inter, used instead of fetching Google Fonts on every run.
+# Build it once from the Inter variable font with:
+#   pyftsubset InterVariable.ttf --unicodes="U+0020-007E,U+00A0-00FF,U+2022,U+2013-2014,U+2713,U+26A0" \
+#       --layout-features='*' --flavor=woff2 --output-file=assets/Inter.subset.woff2
+# If the file is missing the stylesheet imports Inter from Google Fonts as before.
+_INTER_FONT_PATH = Path(__file__).parent / 'assets' / 'Inter.subset.woff2'
+
+# Encoded once at import; the font never changes while the process runs
+_INTER_B64 = (
+    base64.b64encode(_INTER_FONT_PATH.read_bytes()).decode('ascii')
+    if _INTER_FONT_PATH.exists() else None
+)
+_INTER_FONT_FACE = (
+    "@font-face { font-family: 'Inter'; font-weight: 400 700; "
+    f"src: url(data:font/woff2;base64,{_INTER_B64}) format('woff2'); }}\n"
+    if _INTER_B64 else
+    "@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');\n"
+)
+
+# Screen/print styles for the combined document. Kept out of the HTML so it is
+# parsed once into a weasyprint.CSS object instead of on every render.
+_SHARED_CSS_STRING = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
+    line-height: 1.8;
+    color: #333;
+    background: white;
+    font-size: 13px;
+    margin: 0;
+    padding: 20px;
+}
+
+.page-header {
+    text-align: center;
+    margin-bottom: 30px;
+    padding: 20px 0;
+    border-bottom: 2px solid #e1e5e9;
+}
+
+.page-header h1 {
+    font-size: 24px;
+    font-weight: 700;
+    color: #1a365d;
+    margin-bottom: 8px;
+}
+
+.page-header .subtitle {
+    font-size: 16px;
+    color: #718096;
+    font-weight: 500;
+}
+
+.patient-report {
+    margin-bottom: 40px;
+    page-break-inside: avoid;
+}
+
+.page-break {
+    page-break-before: always;
+}
+
+/* Enhanced styles for patient content */
+.patient-info {
+    background: #f7fafc;
+    padding: 20px;
+    border-radius: 8px;
+    margin-bottom: 25px;
+    border-left: 4px solid #4299e1;
+    line-height: 1.6;
+}
+
+.result-box {
+    padding: 25px;
+    border-radius: 8px;
+    margin: 25px 0;
+    text-align: center;
+    font-weight: 600;
+    line-height: 1.8;
+}
+
+.result-positive {
+    background: #f0fff4;
+    border: 2px solid #68d391;
+    color: #22543d;
+}
+
+.result-negative {
+    background: #fff5f5;
+    border: 2px solid #fc8181;
+    color: #742a2a;
+}
+
+.explanation-images {
+    display: flex;
+    justify-content: space-between;
+    margin: 20px 0;
+    gap: 20px;
+}
+
+.image-container {
+    flex: 1;
+    text-align: center;
+}
+
+.image-container img {
+    max-width: 100%;
+    height: auto;
+    border-radius: 8px;
+    border: 1px solid #e2e8f0;
+}
+
+.image-caption {
+    margin-top: 8px;
+    font-size: 12px;
+    color: #718096;
+    font-style: italic;
+}
+
+.explanation-text {
+    background: #fffaf0;
+    padding: 20px;
+    border-radius: 8px;
+    margin: 20px 0;
+    border-left: 4px solid #ed8936;
+    line-height: 1.8;
+}
+
+.next-steps {
+    background: #fff5f5;
+    padding: 20px;
+    border-radius: 8px;
+    margin: 20px 0;
+    border-left: 4px solid #e53e3e;
+    line-height: 1.8;
+}
+
+.disclaimer {
+    background: #f7fafc;
+    padding: 20px;
+    border-radius: 8px;
+    text-align: center;
+    font-size: 12px;
+    color: #4a5568;
+    font-style: italic;
+    margin-top: 30px;
+    line-height: 1.6;
+}
+
+ul, ol {
+    margin: 15px 0;
+    padding-left: 25px;
+    line-height: 1.8;
+}
+
+li {
+    margin: 8px 0;
+    line-height: 1.6;
+}
+
+h1, h2, h3 {
+    margin: 25px 0 15px 0;
+    color: #2d3748;
+    line-height: 1.4;
+}
+
+p {
+    margin: 12px 0;
+    line-height: 1.7;
+}
+
+/* Instructions section */
+.instructions {
+    margin-top: 40px;
+    padding-top: 30px;
+    border-top: 2px solid #e1e5e9;
+}
+
+.instructions h2 {
+    color: #1a365d;
+    font-size: 18px;
+    margin-bottom: 15px;
+}
+
+.code-block {
+    background: #f7fafc;
+    border: 1px solid #e2e8f0;
+    border-radius: 6px;
+    padding: 12px;
+    font-family: 'Courier New', monospace;
+    font-size: 12px;
+    color: #2d3748;
+    margin: 10px 0;
+    overflow-x: auto;
+}
+
+.step-list {
+    counter-reset: step-counter;
+    list-style: none;
+    padding-left: 0;
+}
+
+.step-list li {
+    counter-increment: step-counter;
+    margin: 15px 0;
+    padding-left: 30px;
+    position: relative;
+}
+
+.step-list li::before {
+    content: counter(step-counter);
+    position: absolute;
+    left: 0;
+    top: 0;
+    background: #4299e1;
+    color: white;
+    width: 20px;
+    height: 20px;
+    border-radius: 50%;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    font-size: 12px;
+    font-weight: bold;
+}
+
+/* Print-specific styles */
+@media print {
+    .page-break {
+        page-break-before: always;
+    }
+
+    .patient-report {
+        page-break-inside: avoid;
+    }
+
+    body {
+        font-size: 12px;
+        line-height: 1.6;
+    }
+
+    .page-header h1 {
+        font-size: 18px;
+        margin-bottom: 15px;
+    }
+
+    .patient-info, .result-box, .explanation-text, .next-steps {
+        margin: 15px 0;
+        padding: 15px;
+    }
+
+    ul, ol {
+        margin: 12px 0;
+    }
+
+    li {
+        margin: 6px 0;
+    }
+}
+
+/* Ensure images fit properly */
+img {
+    max-width: 100% !important;
+    height: auto !important;
+}
+
+# WeasyPrint specific adjustments
+.explanation-images {
+    display: block;
+    margin: 20px 0;
+}
+
+.image-container {
+    display: inline-block;
+    width: 48%;
+    vertical-align: top;
+    margin: 1%;
+}
+
+.image-caption {
+    margin-top: 10px;
+    font-size: 11px;
+    color: #718096;
+    font-style: italic;
+    line-height: 1.4;
+}
+'''
+
+# Static layout of the combined document; bodies are filled in with str.format
+_COMBINED_HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Diabetic Retinopathy Patient Explanations</title>
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-        
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-            line-height: 1.8;
-            color: #333;
-            background: white;
-            font-size: 13px;
-            margin: 0;
-            padding: 20px;
-        }}
-        
-        .page-header {{
-            text-align: center;
-            margin-bottom: 30px;
-            padding: 20px 0;
-            border-bottom: 2px solid #e1e5e9;
-        }}
-        
-        .page-header h1 {{
-            font-size: 24px;
-            font-weight: 700;
-            color: #1a365d;
-            margin-bottom: 8px;
-        }}
-        
-        .page-header .subtitle {{
-            font-size: 16px;
-            color: #718096;
-            font-weight: 500;
-        }}
-        
-        .patient-report {{
-            margin-bottom: 40px;
-            page-break-inside: avoid;
-        }}
-        
-        .page-break {{
-            page-break-before: always;
-        }}
-        
-        /* Enhanced styles for patient content */
-        .patient-info {{
-            background: #f7fafc;
-            padding: 20px;
-            border-radius: 8px;
-            margin-bottom: 25px;
-            border-left: 4px solid #4299e1;
-            line-height: 1.6;
-        }}
-        
-        .result-box {{
-            padding: 25px;
-            border-radius: 8px;
-            margin: 25px 0;
-            text-align: center;
-            font-weight: 600;
-            line-height: 1.8;
-        }}
-        
-        .result-positive {{
-            background: #f0fff4;
-            border: 2px solid #68d391;
-            color: #22543d;
-        }}
-        
-        .result-negative {{
-            background: #fff5f5;
-            border: 2px solid #fc8181;
-            color: #742a2a;
-        }}
-        
-        .explanation-images {{
-            display: flex;
-            justify-content: space-between;
-            margin: 20px 0;
-            gap: 20px;
-        }}
-        
-        .image-container {{
-            flex: 1;
-            text-align: center;
-        }}
-        
-        .image-container img {{
-            max-width: 100%;
-            height: auto;
-            border-radius: 8px;
-            border: 1px solid #e2e8f0;
-        }}
-        
-        .image-caption {{
-            margin-top: 8px;
-            font-size: 12px;
-            color: #718096;
-            font-style: italic;
-        }}
-        
-        .explanation-text {{
-            background: #fffaf0;
-            padding: 20px;
-            border-radius: 8px;
-            margin: 20px 0;
-            border-left: 4px solid #ed8936;
-            line-height: 1.8;
-        }}
-        
-        .next-steps {{
-            background: #fff5f5;
-            padding: 20px;
-            border-radius: 8px;
-            margin: 20px 0;
-            border-left: 4px solid #e53e3e;
-            line-height: 1.8;
-        }}
-        
-        .disclaimer {{
-            background: #f7fafc;
-            padding: 20px;
-            border-radius: 8px;
-            text-align: center;
-            font-size: 12px;
-            color: #4a5568;
-            font-style: italic;
-            margin-top: 30px;
-            line-height: 1.6;
-        }}
-        
-        ul, ol {{
-            margin: 15px 0;
-            padding-left: 25px;
-            line-height: 1.8;
-        }}
-        
-        li {{
-            margin: 8px 0;
-            line-height: 1.6;
-        }}
-        
-        h1, h2, h3 {{
-            margin: 25px 0 15px 0;
-            color: #2d3748;
-            line-height: 1.4;
-        }}
-        
-        p {{
-            margin: 12px 0;
-            line-height: 1.7;
-        }}
-        
-        /* Instructions section */
-        .instructions {{
-            margin-top: 40px;
-            padding-top: 30px;
-            border-top: 2px solid #e1e5e9;
-        }}
-        
-        .instructions h2 {{
-            color: #1a365d;
-            font-size: 18px;
-            margin-bottom: 15px;
-        }}
-        
-        .code-block {{
-            background: #f7fafc;
-            border: 1px solid #e2e8f0;
-            border-radius: 6px;
-            padding: 12px;
-            font-family: 'Courier New', monospace;
-            font-size: 12px;
-            color: #2d3748;
-            margin: 10px 0;
-            overflow-x: auto;
-        }}
-        
-        .step-list {{
-            counter-reset: step-counter;
-            list-style: none;
-            padding-left: 0;
-        }}
-        
-        .step-list li {{
-            counter-increment: step-counter;
-            margin: 15px 0;
-            padding-left: 30px;
-            position: relative;
-        }}
-        
-        .step-list li::before {{
-            content: counter(step-counter);
-            position: absolute;
-            left: 0;
-            top: 0;
-            background: #4299e1;
-            color: white;
-            width: 20px;
-            height: 20px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 12px;
-            font-weight: bold;
-        }}
-        
-        /* Print-specific styles */
-        @media print {{
-            .page-break {{
-                page-break-before: always;
-            }}
-            
-            .patient-report {{
-                page-break-inside: avoid;
-            }}
-            
-            body {{
-                font-size: 12px;
-                line-height: 1.6;
-            }}
-            
-            .page-header h1 {{
-                font-size: 18px;
-                margin-bottom: 15px;
-            }}
-            
-            .patient-info, .result-box, .explanation-text, .next-steps {{
-                margin: 15px 0;
-                padding: 15px;
-            }}
-            
-            ul, ol {{
-                margin: 12px 0;
-            }}
-            
-            li {{
-                margin: 6px 0;
-            }}
-        }}
-        
-        /* Ensure images fit properly */
-        img {{
-            max-width: 100% !important;
-            height: auto !important;
-        }}
-        
-        # WeasyPrint specific adjustments
-        .explanation-images {{
-            display: block;
-            margin: 20px 0;
-        }}
-        
-        .image-container {{
-            display: inline-block;
-            width: 48%;
-            vertical-align: top;
-            margin: 1%;
-        }}
-        
-        .image-caption {{
-            margin-top: 10px;
-            font-size: 11px;
-            color: #718096;
-            font-style: italic;
-            line-height: 1.4;
-        }}
-    </style>
 </head>
 <body>
     <div class="page-header">
         <h1>Diabetic Retinopathy Patient Explanations</h1>
         <div class="subtitle">AI-Generated Screening Reports for Individual Patients</div>
-        <div class="subtitle">Generated on {Path().cwd().name} - Assignment 4 Deliverable</div>
+        <div class="subtitle">Generated on {project_name} - Assignment 4 Deliverable</div>
     </div>
     
     <div class="patient-report">
@@ -429,154 +397,277 @@ def create_combined_html(patient_reports_dir, output_html_path):
 </body>
 </html>
 """
+
+def extract_body_content(html_content):
+    """
+    Extract content between <body> tags.
+    
+    Uses selectolax's C parser when available (single pass, tolerant of
+    attributes on <body>), otherwise falls back to a plain byte scan.
+    Only the extracted body is decoded from UTF-8.
+    
+    Args:
+        html_content (bytes): Raw HTML document
+    
+    Returns:
+        str: Inner HTML of the body element
+    """
+    if HTMLParser is not None:
+        body = HTMLParser(html_content).body
+        if body is None:
+            return html_content.decode('utf-8')
+        body_html = body.html
+        return body_html[body_html.find('>') + 1:body_html.rfind('<')]
+    
+    start_tag = b'<body'
+    end_tag = b'</body>'
+    
+    start_idx = html_content.find(start_tag)
+    if start_idx == -1:
+        return html_content.decode('utf-8')
+    
+    # Find end of opening body tag
+    start_idx = html_content.find(b'>', start_idx) + 1
+    end_idx = html_content.rfind(end_tag)
+    
+    if end_idx == -1:
+        return html_content[start_idx:].decode('utf-8')
+    
+    return html_content[start_idx:end_idx].decode('utf-8')
+
+def create_combined_html(patient_reports_dir):
+    """
+    Combine multiple patient HTML reports into a single HTML document.
+    
+    Args:
+        patient_reports_dir (str): Directory containing patient HTML reports
+    
+    Returns:
+        str: Combined HTML document, ready to hand to html_to_pdf
+    """
+    
+    # Find patient HTML reports
+    patient_htmls = []
+    for file in sorted(os.listdir(patient_reports_dir)):
+        if file.endswith('_report.html'):
+            patient_htmls.append(os.path.join(patient_reports_dir, file))
+    
+    if len(patient_htmls) < 2:
+        raise FileNotFoundError(f"Need at least 2 patient HTML reports. Found {len(patient_htmls)}")
+    
+    # Take first two patients for the assignment
+    patient1_html = patient_htmls[0]
+    patient2_html = patient_htmls[1]
+    
+    print(f"Combining reports from:")
+    print(f"  - {patient1_html}")
+    print(f"  - {patient2_html}")
+    
+    # Read raw HTML bytes and fix image paths (decoded once, after extraction)
+    patient1_content = Path(patient1_html).read_bytes()
+    patient2_content = Path(patient2_html).read_bytes()
+    
+    # Embed report PNGs as data: URIs so WeasyPrint never has to fetch them;
+    # any other referenced file falls back to an absolute path. Only images a
+    # report actually references are read and encoded, each at most once.
+    patient_reports_abs = os.path.abspath(patient_reports_dir)
+    abs_src = f'src="{patient_reports_abs}/'.encode('utf-8')
+    inlined_srcs = {}
     
-    # Write combined HTML
-    with open(output_html_path, 'w', encoding='utf-8') as f:
-        f.write(combined_html)
+    def inline_src(match):
+        name = match.group(1)
+        if name not in inlined_srcs:
+            image_path = Path(patient_reports_abs) / name.decode('utf-8')
+            if name.endswith(b'.png') and image_path.is_file():
+                inlined_srcs[name] = b'src="data:image/png;base64,' + base64.b64encode(image_path.read_bytes()) + b'"'
+            else:
+                inlined_srcs[name] = abs_src + name + b'"'
+        return inlined_srcs[name]
     
-    print(f"Combined HTML created: {output_html_path}")
-    return output_html_path
+    patient1_content = _SRC_RE.sub(inline_src, patient1_content)
+    patient2_content = _SRC_RE.sub(inline_src, patient2_content)
+    
+    # Extract body content from each HTML (remove html, head tags)
+    patient1_body = extract_body_content(patient1_content)
+    patient2_body = extract_body_content(patient2_content)
+    
+    # Create combined HTML document
+    combined_html = _COMBINED_HTML_TEMPLATE.format(
+        project_name=Path().cwd().name,
+        patient1_body=patient1_body,
+        patient2_body=patient2_body
+    )
+    
+    print(f"Combined HTML created ({len(combined_html) / 1024:.1f} KB)")
+    return combined_html
+
+# Print stylesheet applied on top of the combined HTML when rendering the PDF
+_PDF_CSS_STRING = '''
+@page {
+    size: Letter;
+    margin: 1in;
+    @top-center {
+        content: "Diabetic Retinopathy Patient Explanations";
+        font-family: Inter, sans-serif;
+        font-size: 10px;
+        color: #666;
+        margin-bottom: 20px;
+    }
+    @bottom-center {
+        content: "Page " counter(page) " of " counter(pages);
+        font-family: Inter, sans-serif;
+        font-size: 10px;
+        color: #666;
+        margin-top: 20px;
+    }
+}
+
+body {
+    font-size: 12px;
+    line-height: 1.7;
+    margin: 0;
+    padding: 0;
+}
+
+.page-header {
+    margin-bottom: 30px;
+    padding-bottom: 20px;
+}
+
+.page-header h1 {
+    font-size: 18px;
+    line-height: 1.3;
+    margin-bottom: 10px;
+}
+
+.patient-report {
+    margin-bottom: 40px;
+    page-break-inside: avoid;
+}
+
+.patient-info, .result-box, .explanation-text, .next-steps {
+    margin: 20px 0;
+    padding: 18px;
+    page-break-inside: avoid;
+}
+
+.explanation-images {
+    display: block;
+    margin: 25px 0;
+    page-break-inside: avoid;
+}
 
-def html_to_pdf(html_path, pdf_path):
+.image-container {
+    display: inline-block;
+    width: 48%;
+    vertical-align: top;
+    margin: 1%;
+}
+
+.image-container img {
+    max-width: 100% !important;
+    height: auto !important;
+    display: block;
+}
+
+.image-caption {
+    margin-top: 8px;
+    font-size: 10px;
+    line-height: 1.3;
+    text-align: center;
+}
+
+ul, ol {
+    margin: 15px 0;
+    padding-left: 25px;
+}
+
+li {
+    margin: 6px 0;
+    line-height: 1.6;
+}
+
+h1, h2, h3 {
+    margin-top: 25px;
+    margin-bottom: 15px;
+    line-height: 1.3;
+    page-break-after: avoid;
+}
+
+p {
+    margin: 10px 0;
+    line-height: 1.7;
+}
+
+.disclaimer {
+    margin-top: 30px;
+    padding: 15px;
+    line-height: 1.5;
+}
+
+.instructions {
+    margin-top: 30px;
+    page-break-before: always;
+}
+
+.code-block {
+    margin: 15px 0;
+    padding: 12px;
+    font-size: 10px;
+    line-height: 1.4;
+    page-break-inside: avoid;
+}
+
+.step-list li {
+    margin: 12px 0;
+    line-height: 1.6;
+}
+'''
+
+# Parsed once per process and reused by every html_to_pdf call
+_FONT_CONFIG = None
+_STYLESHEETS = None
+
+def _get_pdf_stylesheets():
     """
-    Convert HTML to PDF using WeasyPrint.
+    Return the cached ([shared CSS, print CSS], FontConfiguration) used for rendering.
+    
+    Parsing the stylesheets and initializing fontconfig are the bulk of
+    WeasyPrint's per-call setup, so they are built lazily on first use.
+    """
+    global _FONT_CONFIG, _STYLESHEETS
+    if _STYLESHEETS is None:
+        _FONT_CONFIG = FontConfiguration()
+        _STYLESHEETS = [
+            CSS(string=_INTER_FONT_FACE + _SHARED_CSS_STRING, font_config=_FONT_CONFIG),
+            CSS(string=_PDF_CSS_STRING, font_config=_FONT_CONFIG),
+        ]
+    return _STYLESHEETS, _FONT_CONFIG
+
+def html_to_pdf(html_string, pdf_path, base_url=None):
+    """
+    Convert an HTML document to PDF using WeasyPrint.
+    
+    WeasyPrint keeps growing per-font caches across write_pdf calls, so the
+    document is released and garbage-collected after every render. When
+    producing more than ~50 PDFs in one run, prefer
+    ``generate_patient_report.py --batch`` so worker processes return that
+    memory when they exit.
     
     Args:
-        html_path (str): Path to HTML file
+        html_string (str): HTML document to render (no temp file needed)
         pdf_path (str): Path where PDF will be saved
+        base_url (str, optional): Base for resolving any relative URLs
     """
+    html_doc = None
     try:
-        # Font configuration for better text rendering
-        font_config = FontConfiguration()
-        
-        # Custom CSS for PDF optimization
-        pdf_css = CSS(string='''
-            @page {
-                size: Letter;
-                margin: 1in;
-                @top-center {
-                    content: "Diabetic Retinopathy Patient Explanations";
-                    font-family: Inter, sans-serif;
-                    font-size: 10px;
-                    color: #666;
-                    margin-bottom: 20px;
-                }
-                @bottom-center {
-                    content: "Page " counter(page) " of " counter(pages);
-                    font-family: Inter, sans-serif;
-                    font-size: 10px;
-                    color: #666;
-                    margin-top: 20px;
-                }
-            }
-            
-            body {
-                font-size: 12px;
-                line-height: 1.7;
-                margin: 0;
-                padding: 0;
-            }
-            
-            .page-header {
-                margin-bottom: 30px;
-                padding-bottom: 20px;
-            }
-            
-            .page-header h1 {
-                font-size: 18px;
-                line-height: 1.3;
-                margin-bottom: 10px;
-            }
-            
-            .patient-report {
-                margin-bottom: 40px;
-                page-break-inside: avoid;
-            }
-            
-            .patient-info, .result-box, .explanation-text, .next-steps {
-                margin: 20px 0;
-                padding: 18px;
-                page-break-inside: avoid;
-            }
-            
-            .explanation-images {
-                display: block;
-                margin: 25px 0;
-                page-break-inside: avoid;
-            }
-            
-            .image-container {
-                display: inline-block;
-                width: 48%;
-                vertical-align: top;
-                margin: 1%;
-            }
-            
-            .image-container img {
-                max-width: 100% !important;
-                height: auto !important;
-                display: block;
-            }
-            
-            .image-caption {
-                margin-top: 8px;
-                font-size: 10px;
-                line-height: 1.3;
-                text-align: center;
-            }
-            
-            ul, ol {
-                margin: 15px 0;
-                padding-left: 25px;
-            }
-            
-            li {
-                margin: 6px 0;
-                line-height: 1.6;
-            }
-            
-            h1, h2, h3 {
-                margin-top: 25px;
-                margin-bottom: 15px;
-                line-height: 1.3;
-                page-break-after: avoid;
-            }
-            
-            p {
-                margin: 10px 0;
-                line-height: 1.7;
-            }
-            
-            .disclaimer {
-                margin-top: 30px;
-                padding: 15px;
-                line-height: 1.5;
-            }
-            
-            .instructions {
-                margin-top: 30px;
-                page-break-before: always;
-            }
-            
-            .code-block {
-                margin: 15px 0;
-                padding: 12px;
-                font-size: 10px;
-                line-height: 1.4;
-                page-break-inside: avoid;
-            }
-            
-            .step-list li {
-                margin: 12px 0;
-                line-height: 1.6;
-            }
-        ''', font_config=font_config)
+        stylesheets, font_config = _get_pdf_stylesheets()
         
         print("Converting HTML to PDF...")
         
         # Convert to PDF
-        html_doc = HTML(filename=html_path)
-        html_doc.write_pdf(pdf_path, stylesheets=[pdf_css], font_config=font_config)
+        html_doc = HTML(string=html_string, base_url=base_url)
+        html_doc.write_pdf(pdf_path, stylesheets=stylesheets, font_config=font_config)
         
         print(f"PDF successfully created: {pdf_path}")
         return True
@@ -585,6 +676,11 @@ def html_to_pdf(html_path, pdf_path):
         print(f"Error converting HTML to PDF: {e}")
         print("Make sure WeasyPrint is installed: pip install weasyprint")
         return False
+    
+    finally:
+        # Drop the rendered document so its box tree and font caches can be freed
+        del html_doc
+        gc.collect()
 
 def main():
     """Main function to generate explanation_local.pdf from HTML reports."""
@@ -592,7 +688,6 @@ def main():
     # Setup paths
     project_root = Path(__file__).parent
     patient_reports_dir = project_root / "outputs" / "patient_reports"
-    output_html = project_root / "temp_combined_report.html"
     output_pdf = project_root / "explanation_local.pdf"
     
     # Check if patient reports directory exists
@@ -608,20 +703,12 @@ def main():
     
     try:
         # Step 1: Create combined HTML
-        combined_html_path = create_combined_html(
-            str(patient_reports_dir), 
-            str(output_html)
-        )
+        combined_html = create_combined_html(str(patient_reports_dir))
         
         # Step 2: Convert HTML to PDF
-        success = html_to_pdf(str(output_html), str(output_pdf))
+        success = html_to_pdf(combined_html, str(output_pdf), base_url=str(project_root))
         
         if success:
-            # Clean up temporary HTML file
-            if output_html.exists():
-                output_html.unlink()
-                print("Temporary HTML file cleaned up.")
-            
             print("\n✅ SUCCESS!")
             print(f"📄 explanation_local.pdf has been generated successfully!")
             print(f"📍 Location: {output_pdf.absolute()}")
@@ -639,11 +726,6 @@ def main():
             
     except Exception as e:
         print(f"\n❌ Error during generation: {e}")
-        
-        # Clean up on error
-        if output_html.exists():
-            output_html.unlink()
-            
         sys.exit(1)
 
 if __name__ == "__main__":
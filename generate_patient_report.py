@@ -2,13 +2,17 @@
 """
 Quick script to generate HTML patient reports and optionally convert to PDF.
 Usage: python generate_patient_report.py --patient_id <ID> --image_path <PATH>
+       python generate_patient_report.py --batch patients.csv
 """
 
 import argparse
+import csv
+import functools
+import multiprocessing
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import numpy as np
 from PIL import Image
 import tensorflow as tf
 
@@ -17,29 +21,164 @@ sys.path.append(str(Path(__file__).parent / 'src'))
 
 from html_generator import HTMLGenerator
 from explanation_utils import ExplanationGenerator
-from model_utils import ModelHandler
+from model_utils import ModelHandler, TFLitePredictor, convert_to_tflite_int8
 from data_utils import DataLoader
 
+# Grow GPU memory on demand instead of reserving the whole device up front
+_GPUS = tf.config.list_physical_devices('GPU')
+for _gpu in _GPUS:
+    tf.config.experimental.set_memory_growth(_gpu, True)
+_DEVICE = '/GPU:0' if _GPUS else '/CPU:0'
+
+# Trained model expected in the project root
+_MODEL_PATH = "model.h5"
+
+# Optional INT8 model produced by --export_int8; used for inference when present
+_TFLITE_MODEL_PATH = "model_int8.tflite"
+
+# Threads per TFLite interpreter; batch workers set their share of the CPU
+_NUM_THREADS = None
+
+# Class index -> diagnosis label
+_CLASS_NAMES = ("No DR", "Mild DR", "Moderate DR", "Severe DR", "Proliferative DR")
+
+# Command line interface, built once at import time
+_PARSER = argparse.ArgumentParser(
+    description='Generate patient explanation reports from retinal images',
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    epilog='''
+Examples:
+    python generate_patient_report.py --patient_id P123 --image_path images/retinal_scan.jpg
+    python generate_patient_report.py --patient_id P456 --image_path scan.png --age 65 --gender Female
+    python generate_patient_report.py --patient_id P789 --image_path folder/image.jpg --pdf
+    python generate_patient_report.py --batch patients.csv --workers 4
+        '''
+)
+
+_PARSER.add_argument('--patient_id',
+                     help='Unique identifier for the patient')
+
+_PARSER.add_argument('--image_path',
+                     help='Path to the retinal image file (JPG/PNG)')
+
+_PARSER.add_argument('--age', type=int,
+                     help='Patient age (optional)')
+
+_PARSER.add_argument('--gender', choices=['Male', 'Female', 'Other'],
+                     help='Patient gender (optional)')
+
+_PARSER.add_argument('--pdf', action='store_true',
+                     help='Also generate/update explanation_local.pdf')
+
+_PARSER.add_argument('--batch', metavar='CSV',
+                     help='CSV with patient_id,image_path[,age,gender] columns; '
+                          'reports are generated in parallel worker processes')
+
+_PARSER.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='Number of worker processes for --batch (default: CPU count)')
+
+_PARSER.add_argument('--export_int8', metavar='IMAGE_DIR',
+                     help=f'Quantize {_MODEL_PATH} to {_TFLITE_MODEL_PATH} using the images '
+                          'in IMAGE_DIR for calibration, then exit')
+
+@functools.lru_cache(maxsize=1)
+def _get_model(model_path):
+    """Load the Keras model once per process and reuse it for every report."""
+    return tf.keras.models.load_model(model_path)
+
+@functools.lru_cache(maxsize=1)
+def _get_infer(model_path):
+    """
+    Compile the model's forward pass with XLA once and warm it up.
+    
+    The input lives in a persistent (1, 224, 224, 3) variable on the
+    inference device, so each call only assigns into an existing buffer.
+    """
+    model = _get_model(model_path)
+    with tf.device(_DEVICE):
+        input_buf = tf.Variable(tf.zeros((1, 224, 224, 3), tf.float32), trainable=False)
+        infer = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)],
+            jit_compile=True
+        )
+        infer(input_buf)
+    
+    def run(img_array):
+        with tf.device(_DEVICE):
+            input_buf.assign(img_array)
+            return infer(input_buf)
+    
+    return run
+
+@functools.lru_cache(maxsize=1)
+def _get_tflite_predictor(tflite_path):
+    """Load the INT8 TFLite model once per process."""
+    return TFLitePredictor(tflite_path, num_threads=_NUM_THREADS)
+
+def export_int8_tflite(image_dir, model_path=_MODEL_PATH, output_path=_TFLITE_MODEL_PATH,
+                       max_images=100):
+    """
+    Post-training quantize the Keras model to a full-integer TFLite model.
+    
+    Args:
+        image_dir (str): Directory of representative retinal images for calibration
+        model_path (str): Keras model to convert
+        output_path (str): Where the .tflite file is written
+        max_images (int): Maximum number of calibration images
+    
+    Returns:
+        str: Path to the written .tflite model
+    """
+    image_paths = sorted(
+        str(p) for p in Path(image_dir).iterdir()
+        if p.suffix.lower() in ('.png', '.jpg', '.jpeg')
+    )[:max_images]
+    
+    def representative_dataset():
+        for image_path in image_paths:
+            img_array, _ = load_and_preprocess_image(image_path)
+            if img_array is not None:
+                yield [img_array]
+    
+    convert_to_tflite_int8(_get_model(model_path), representative_dataset, output_path)
+    
+    print(f"✅ INT8 model saved: {output_path} (calibrated on {len(image_paths)} images)")
+    return output_path
+
+@functools.lru_cache(maxsize=1)
+def _get_generators(model):
+    """Build the model handler, explanation and HTML generators once per model."""
+    model_handler = ModelHandler()
+    explanation_gen = ExplanationGenerator(model, model_handler)
+    html_gen = HTMLGenerator()
+    return model_handler, explanation_gen, html_gen
+
 def load_and_preprocess_image(image_path):
-    """Load and preprocess a single image for model prediction."""
+    """
+    Load and preprocess a single image for model prediction.
+    
+    Decoding and resizing run through tf.image (libjpeg-turbo/libpng and
+    vectorized resize) and the result stays float32 end to end.
+    
+    Returns:
+        tuple: (float32 batch of shape (1, 224, 224, 3) scaled to 0-1,
+                resized 224x224 RGB PIL image kept for display)
+    """
     try:
-        # Load image
-        img = Image.open(image_path)
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        # Decode to RGB (drops alpha / expands grayscale)
+        raw = tf.io.read_file(image_path)
+        img = tf.image.decode_image(raw, channels=3, expand_animations=False)
         
-        # Resize to model input size
-        img = img.resize((224, 224))
-        
-        # Convert to numpy array and normalize
-        img_array = np.array(img) / 255.0
+        # Resize to model input size and normalize in float32
+        img = tf.image.resize(img, [224, 224])
+        display_img = Image.fromarray(tf.cast(tf.round(img), tf.uint8).numpy())
+        img = tf.cast(img, tf.float32) / 255.0
         
         # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
+        img_array = tf.expand_dims(img, axis=0).numpy()
         
-        return img_array, img
+        return img_array, display_img
     
     except Exception as e:
         print(f"Error loading image {image_path}: {e}")
@@ -64,7 +203,7 @@ def generate_single_patient_report(patient_id, image_path, age=None, gender=None
     
     try:
         # Check if required files exist
-        model_path = "model.h5"
+        model_path = _MODEL_PATH
         if not os.path.exists(model_path):
             print(f"❌ Model file not found: {model_path}")
             return False
@@ -75,7 +214,7 @@ def generate_single_patient_report(patient_id, image_path, age=None, gender=None
         
         # Load model
         print("📥 Loading model...")
-        model = tf.keras.models.load_model(model_path)
+        model = _get_model(model_path)
         
         # Load and preprocess image
         print("🖼️  Loading and preprocessing image...")
@@ -83,37 +222,31 @@ def generate_single_patient_report(patient_id, image_path, age=None, gender=None
         if img_array is None:
             return False
         
-        # Make prediction
+        # Make prediction (INT8 TFLite model if it has been exported)
         print("🤖 Making prediction...")
-        prediction = model.predict(img_array, verbose=0)
-        predicted_class = np.argmax(prediction[0])
-        confidence = np.max(prediction[0]) * 100
-        
-        # Class mapping
-        class_names = {
-            0: "No DR",
-            1: "Mild DR", 
-            2: "Moderate DR",
-            3: "Severe DR",
-            4: "Proliferative DR"
-        }
+        if os.path.exists(_TFLITE_MODEL_PATH):
+            prediction = _get_tflite_predictor(_TFLITE_MODEL_PATH).predict(img_array)
+        else:
+            prediction = _get_infer(model_path)(img_array).numpy()
+        predicted_class = int(prediction[0].argmax())
+        confidence = float(prediction[0][predicted_class]) * 100
         
-        diagnosis = class_names.get(predicted_class, "Unknown")
+        diagnosis = _CLASS_NAMES[predicted_class] if 0 <= predicted_class < len(_CLASS_NAMES) else "Unknown"
         
         print(f"📊 Prediction: {diagnosis} (Confidence: {confidence:.1f}%)")
         
         # Initialize generators
-        model_handler = ModelHandler()
-        explanation_gen = ExplanationGenerator(model, model_handler)
-        html_gen = HTMLGenerator()
+        model_handler, explanation_gen, html_gen = _get_generators(model)
         
         # Generate explanations (following 04_local_explanations.ipynb workflow)
         print("🔍 Generating Grad-CAM explanations...")
         try:
             # Use Grad-CAM (more reliable with TensorFlow 2.15)
-            gradcam_heatmap = explanation_gen.generate_gradcam_visualization(
-                img_array, predicted_class
-            )
+            # Keep gradients/activations on the inference device until the final heatmap
+            with tf.device(_DEVICE):
+                gradcam_heatmap = explanation_gen.generate_gradcam_visualization(
+                    img_array, predicted_class
+                )
         except Exception as e:
             print(f"Warning: Grad-CAM visualization failed: {e}")
             gradcam_heatmap = None
@@ -156,60 +289,97 @@ def generate_single_patient_report(patient_id, image_path, age=None, gender=None
         print(f"❌ Error generating report: {e}")
         return False
 
-def main():
-    """Main function with command line interface."""
-    parser = argparse.ArgumentParser(
-        description='Generate patient explanation reports from retinal images',
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog='''
-Examples:
-    python generate_patient_report.py --patient_id P123 --image_path images/retinal_scan.jpg
-    python generate_patient_report.py --patient_id P456 --image_path scan.png --age 65 --gender Female
-    python generate_patient_report.py --patient_id P789 --image_path folder/image.jpg --pdf
-        '''
+def _init_worker(model_path, num_threads):
+    """Preload the model once in each batch worker process."""
+    global _NUM_THREADS
+    # Split the cores between workers so N workers don't oversubscribe the CPU
+    _NUM_THREADS = num_threads
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    if os.path.exists(model_path):
+        _get_infer(model_path)
+
+def _one_patient(row):
+    """Generate the report for one CSV row inside a worker process."""
+    age = row.get('age')
+    return generate_single_patient_report(
+        patient_id=row['patient_id'],
+        image_path=row['image_path'],
+        age=int(age) if age else None,
+        gender=row.get('gender') or None
     )
+
+def generate_batch_reports(csv_path, max_workers=None):
+    """
+    Generate reports for every patient listed in a CSV file in parallel.
     
-    parser.add_argument('--patient_id', required=True,
-                       help='Unique identifier for the patient')
+    Args:
+        csv_path (str): CSV with patient_id and image_path columns (age and gender optional)
+        max_workers (int, optional): Number of worker processes (default: CPU count)
     
-    parser.add_argument('--image_path', required=True,
-                       help='Path to the retinal image file (JPG/PNG)')
+    Returns:
+        bool: True if every report was generated successfully
+    """
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
     
-    parser.add_argument('--age', type=int,
-                       help='Patient age (optional)')
+    if not rows:
+        print(f"❌ No patients found in {csv_path}")
+        return False
     
-    parser.add_argument('--gender', choices=['Male', 'Female', 'Other'],
-                       help='Patient gender (optional)')
+    max_workers = min(max_workers or os.cpu_count(), len(rows))
+    print(f"👥 Generating {len(rows)} reports with {max_workers} worker processes...")
     
-    parser.add_argument('--pdf', action='store_true',
-                       help='Also generate/update explanation_local.pdf')
+    # spawn (not fork) so every worker gets a clean TensorFlow runtime
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(_MODEL_PATH,
+                                       max(1, os.cpu_count() // max_workers))) as executor:
+        results = list(executor.map(_one_patient, rows))
     
-    args = parser.parse_args()
+    print(f"\n📊 {sum(results)}/{len(rows)} reports generated successfully")
+    return all(results)
+
+def main():
+    """Main function with command line interface."""
+    args = _PARSER.parse_args()
     
     print("🏥 Diabetic Retinopathy Patient Report Generator")
     print("=" * 50)
     
-    # Generate the report
-    success = generate_single_patient_report(
-        patient_id=args.patient_id,
-        image_path=args.image_path,
-        age=args.age,
-        gender=args.gender
-    )
+    if args.export_int8:
+        export_int8_tflite(args.export_int8)
+        return
+    
+    # Generate the report(s)
+    if args.batch:
+        success = generate_batch_reports(args.batch, max_workers=args.workers)
+    else:
+        if not args.patient_id or not args.image_path:
+            _PARSER.error('--patient_id and --image_path are required unless --batch is given')
+        
+        success = generate_single_patient_report(
+            patient_id=args.patient_id,
+            image_path=args.image_path,
+            age=args.age,
+            gender=args.gender
+        )
     
     if success and args.pdf:
         print("\n📄 Updating explanation_local.pdf...")
         try:
-            # Import and run PDF generation
-            import subprocess
-            result = subprocess.run([
-                sys.executable, "generate_local_pdf_from_html.py"
-            ], capture_output=True, text=True)
+            # Run PDF generation in-process (reuses cached stylesheet/font config)
+            from generate_local_pdf_from_html import create_combined_html, html_to_pdf
+            
+            project_root = Path(__file__).parent
+            combined_html = create_combined_html(str(project_root / "outputs" / "patient_reports"))
             
-            if result.returncode == 0:
+            if html_to_pdf(combined_html, str(project_root / "explanation_local.pdf"),
+                           base_url=str(project_root)):
                 print("✅ PDF updated successfully!")
             else:
-                print(f"❌ PDF generation failed: {result.stderr}")
+                print("❌ PDF generation failed")
         
         except Exception as e:
             print(f"❌ Error updating PDF: {e}")
@@ -5,16 +5,85 @@ Regenerate patient reports with improved HTML formatting
 
 import sys
 import os
+import functools
+import hashlib
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 sys.path.append('.')
 
 import numpy as np
 import pandas as pd
+import tensorflow as tf
 from src.data_utils import load_data, load_image
-from src.model_utils import load_trained_model, predict_single, CLASS_NAMES
+from src.model_utils import load_trained_model, CLASS_NAMES
 from src.explanation_utils import get_gradcam_heatmap, overlay_heatmap, generate_confidence_chart, create_simple_heatmap_overlay
 from src.html_generator import generate_patient_report_html
 import matplotlib.pyplot as plt
 
+# Section rules used throughout the plain-language report
+_EQ60 = "=" * 60
+_DASH60 = "-" * 60
+
+_MODEL_PATH = 'model/model.h5'
+_TARGET_SIZE = (320, 320)
+
+# Per-patient prediction + PNG artifacts, keyed by model weights and inputs
+_CACHE_DIR = Path('outputs/.report_cache')
+
+
+@functools.lru_cache(maxsize=None)
+def _model_digest(model_path):
+    """Short SHA-256 of the model file (streamed, computed once per run)"""
+    h = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def _cache_key(patient_id, model_path=_MODEL_PATH, target_size=_TARGET_SIZE):
+    """Cache key for one patient's artifacts"""
+    return f"{_model_digest(model_path)}_{patient_id}_{target_size[0]}x{target_size[1]}"
+
+
+def _cache_paths(key):
+    """(prediction json, overlay png, confidence png) paths for a cache key"""
+    return (_CACHE_DIR / f'{key}.json',
+            _CACHE_DIR / f'{key}_overlay.png',
+            _CACHE_DIR / f'{key}_conf.png')
+
+
+def _load_cached(key, overlay_path, conf_path):
+    """Copy cached PNGs into place and return the cached prediction dict"""
+    json_path, cached_overlay, cached_conf = _cache_paths(key)
+    shutil.copyfile(cached_overlay, overlay_path)
+    shutil.copyfile(cached_conf, conf_path)
+    prediction = json.loads(json_path.read_text())
+    prediction['probabilities'] = np.asarray(prediction['probabilities'], dtype=np.float32)
+    return prediction
+
+
+def _store_cached(key, prediction, overlay_path, conf_path):
+    """
+    Save a freshly computed prediction and its PNGs under a cache key
+    
+    Each file is written to a temporary name and renamed into place, JSON last,
+    so an interrupted run never leaves an entry that looks complete.
+    """
+    json_path, cached_overlay, cached_conf = _cache_paths(key)
+    _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for src, dst in ((overlay_path, cached_overlay), (conf_path, cached_conf)):
+        tmp = dst.with_name(dst.name + '.tmp')
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    tmp = json_path.with_name(json_path.name + '.tmp')
+    tmp.write_text(json.dumps(
+        dict(prediction, probabilities=[float(p) for p in prediction['probabilities']])
+    ))
+    os.replace(tmp, json_path)
+
 def generate_patient_explanation_text(patient_info, predicted_class, confidence, probabilities):
     """Generate plain language explanation (8th grade level)"""
     
@@ -24,107 +93,108 @@ def generate_patient_explanation_text(patient_info, predicted_class, confidence,
     patient_gender = "male" if patient_info['gender'] == 'M' else "female"
     
     # Intro
-    text = f"EYE SCREENING REPORT\n"
-    text += f"{'='*60}\n\n"
-    text += f"Patient Information:\n"
-    text += f"• Age: {patient_age} years old\n"
-    text += f"• Gender: {patient_gender.capitalize()}\n"
-    text += f"• Screening Date: Today\n\n"
+    parts: list[str] = []
+    parts.append(f"EYE SCREENING REPORT\n")
+    parts.append(f"{_EQ60}\n\n")
+    parts.append(f"Patient Information:\n")
+    parts.append(f"• Age: {patient_age} years old\n")
+    parts.append(f"• Gender: {patient_gender.capitalize()}\n")
+    parts.append(f"• Screening Date: Today\n\n")
     
     # Main finding
-    text += f"WHAT WE FOUND\n"
-    text += f"{'-'*60}\n\n"
+    parts.append(f"WHAT WE FOUND\n")
+    parts.append(f"{_DASH60}\n\n")
     
     if predicted_class == 0:
-        text += f"✓ Good News: No Signs of Eye Disease Found\n\n"
-        text += f"The computer screening tool looked at your eye photo carefully. "
-        text += f"It checked your blood vessels and other parts of your eye. "
-        text += f"Everything looks healthy and normal.\n\n"
+        parts.append(f"✓ Good News: No Signs of Eye Disease Found\n\n")
+        parts.append(f"The computer screening tool looked at your eye photo carefully. ")
+        parts.append(f"It checked your blood vessels and other parts of your eye. ")
+        parts.append(f"Everything looks healthy and normal.\n\n")
     elif predicted_class == 1:
-        text += f"⚠ Early Signs Detected: Mild Changes\n\n"
-        text += f"The computer found some early changes in your eye. "
-        text += f"These are small signs that your eye doctor should check. "
-        text += f"Finding these early is good because treatment works best when started early.\n\n"
+        parts.append(f"⚠ Early Signs Detected: Mild Changes\n\n")
+        parts.append(f"The computer found some early changes in your eye. ")
+        parts.append(f"These are small signs that your eye doctor should check. ")
+        parts.append(f"Finding these early is good because treatment works best when started early.\n\n")
     elif predicted_class == 2:
-        text += f"⚠ Moderate Changes Detected\n\n"
-        text += f"The computer found changes in your eye that need attention from an eye doctor. "
-        text += f"There are signs of blood vessel damage. "
-        text += f"This doesn't mean you're going blind, but you should see a specialist soon.\n\n"
+        parts.append(f"⚠ Moderate Changes Detected\n\n")
+        parts.append(f"The computer found changes in your eye that need attention from an eye doctor. ")
+        parts.append(f"There are signs of blood vessel damage. ")
+        parts.append(f"This doesn't mean you're going blind, but you should see a specialist soon.\n\n")
     elif predicted_class == 3:
-        text += f"⚠️ Severe Changes Detected\n\n"
-        text += f"The computer found serious changes in your eye. "
-        text += f"Your blood vessels show significant damage that needs treatment. "
-        text += f"Please see an eye doctor as soon as possible.\n\n"
+        parts.append(f"⚠️ Severe Changes Detected\n\n")
+        parts.append(f"The computer found serious changes in your eye. ")
+        parts.append(f"Your blood vessels show significant damage that needs treatment. ")
+        parts.append(f"Please see an eye doctor as soon as possible.\n\n")
     else:  # Class 4
-        text += f"⚠️ Advanced Changes Detected\n\n"
-        text += f"The computer found advanced changes in your eye. "
-        text += f"There is serious blood vessel damage that needs immediate medical attention. "
-        text += f"Please contact an eye doctor right away.\n\n"
+        parts.append(f"⚠️ Advanced Changes Detected\n\n")
+        parts.append(f"The computer found advanced changes in your eye. ")
+        parts.append(f"There is serious blood vessel damage that needs immediate medical attention. ")
+        parts.append(f"Please contact an eye doctor right away.\n\n")
     
     # Confidence
-    text += f"HOW SURE IS THE COMPUTER?\n"
-    text += f"{'-'*60}\n\n"
-    text += f"The computer is {confidence_pct}% confident about this result.\n\n"
+    parts.append(f"HOW SURE IS THE COMPUTER?\n")
+    parts.append(f"{_DASH60}\n\n")
+    parts.append(f"The computer is {confidence_pct}% confident about this result.\n\n")
     
     if confidence >= 0.9:
-        text += f"This is a high confidence score. The computer is very sure about what it saw.\n\n"
+        parts.append(f"This is a high confidence score. The computer is very sure about what it saw.\n\n")
     elif confidence >= 0.7:
-        text += f"This is a medium confidence score. The computer is fairly sure, but not certain.\n\n"
+        parts.append(f"This is a medium confidence score. The computer is fairly sure, but not certain.\n\n")
     else:
-        text += f"This is a lower confidence score. The computer is less sure about this result. "
-        text += f"An eye doctor should definitely review your case.\n\n"
+        parts.append(f"This is a lower confidence score. The computer is less sure about this result. ")
+        parts.append(f"An eye doctor should definitely review your case.\n\n")
     
     # What the computer looked at
-    text += f"HOW THE COMPUTER ANALYZES YOUR EYE\n"
-    text += f"{'-'*60}\n\n"
-    text += f"The computer uses a technique called 'Grad-CAM' to highlight areas that help it make decisions. "
-    text += f"This shows which parts of your eye it focused on:\n\n"
-    text += f"• Blood vessels and their patterns\n"
-    text += f"• Areas that might show bleeding or fluid leakage\n"
-    text += f"• Changes in the retina structure\n"
-    text += f"• Overall eye health indicators\n\n"
-    text += f"The colored highlight areas in your report show where the computer 'looked' most carefully.\n\n"
+    parts.append(f"HOW THE COMPUTER ANALYZES YOUR EYE\n")
+    parts.append(f"{_DASH60}\n\n")
+    parts.append(f"The computer uses a technique called 'Grad-CAM' to highlight areas that help it make decisions. ")
+    parts.append(f"This shows which parts of your eye it focused on:\n\n")
+    parts.append(f"• Blood vessels and their patterns\n")
+    parts.append(f"• Areas that might show bleeding or fluid leakage\n")
+    parts.append(f"• Changes in the retina structure\n")
+    parts.append(f"• Overall eye health indicators\n\n")
+    parts.append(f"The colored highlight areas in your report show where the computer 'looked' most carefully.\n\n")
     
     # What to do next
-    text += f"WHAT TO DO NEXT\n"
-    text += f"{'-'*60}\n\n"
+    parts.append(f"WHAT TO DO NEXT\n")
+    parts.append(f"{_DASH60}\n\n")
     
     if predicted_class == 0:
-        text += f"✓ Come back for another screening in 1 year\n"
-        text += f"✓ Keep managing your diabetes with your regular doctor\n"
-        text += f"✓ Tell your doctor right away if your vision changes\n"
-        text += f"✓ Control your blood sugar, blood pressure, and cholesterol\n\n"
+        parts.append(f"✓ Come back for another screening in 1 year\n")
+        parts.append(f"✓ Keep managing your diabetes with your regular doctor\n")
+        parts.append(f"✓ Tell your doctor right away if your vision changes\n")
+        parts.append(f"✓ Control your blood sugar, blood pressure, and cholesterol\n\n")
     else:
-        text += f"⚠ See an eye specialist (ophthalmologist) for a complete exam\n"
+        parts.append(f"⚠ See an eye specialist (ophthalmologist) for a complete exam\n")
         if predicted_class >= 3:
-            text += f"⚠ Do this as soon as possible - within the next few days\n"
+            parts.append(f"⚠ Do this as soon as possible - within the next few days\n")
         else:
-            text += f"⚠ Do this within the next few weeks\n"
-        text += f"✓ Keep managing your diabetes with your regular doctor\n"
-        text += f"✓ Control your blood sugar - this is very important!\n"
-        text += f"✓ Tell your doctor if you notice any vision changes\n\n"
+            parts.append(f"⚠ Do this within the next few weeks\n")
+        parts.append(f"✓ Keep managing your diabetes with your regular doctor\n")
+        parts.append(f"✓ Control your blood sugar - this is very important!\n")
+        parts.append(f"✓ Tell your doctor if you notice any vision changes\n\n")
     
     # Important reminders
-    text += f"IMPORTANT REMINDERS\n"
-    text += f"{'-'*60}\n\n"
-    text += f"• This is a SCREENING tool, not a final diagnosis\n"
-    text += f"• Only a real eye doctor can give you a complete diagnosis\n"
-    text += f"• This tool helps find people who need to see a specialist\n"
-    text += f"• Even if the result is good, see an eye doctor regularly\n"
-    text += f"• Managing your diabetes is the best way to protect your eyes\n\n"
+    parts.append(f"IMPORTANT REMINDERS\n")
+    parts.append(f"{_DASH60}\n\n")
+    parts.append(f"• This is a SCREENING tool, not a final diagnosis\n")
+    parts.append(f"• Only a real eye doctor can give you a complete diagnosis\n")
+    parts.append(f"• This tool helps find people who need to see a specialist\n")
+    parts.append(f"• Even if the result is good, see an eye doctor regularly\n")
+    parts.append(f"• Managing your diabetes is the best way to protect your eyes\n\n")
     
     # Confidence breakdown
-    text += f"DETAILED CONFIDENCE SCORES\n"
-    text += f"{'-'*60}\n\n"
-    text += f"How confident the computer is for each possibility:\n\n"
+    parts.append(f"DETAILED CONFIDENCE SCORES\n")
+    parts.append(f"{_DASH60}\n\n")
+    parts.append(f"How confident the computer is for each possibility:\n\n")
     
-    for i, class_name in enumerate(CLASS_NAMES):
-        prob = probabilities[i] * 100
-        text += f"  {class_name:.<40} {prob:>5.1f}%\n"
+    parts.append("".join(
+        f"  {n:.<40} {p * 100:>5.1f}%\n" for n, p in zip(CLASS_NAMES, probabilities)
+    ))
     
-    text += f"\n{'='*60}\n"
+    parts.append(f"\n{_EQ60}\n")
     
-    return text
+    return "".join(parts)
 
 def regenerate_patient_reports():
     """Regenerate both patient reports with improved formatting."""
@@ -132,36 +202,99 @@ def regenerate_patient_reports():
     print("🔄 Regenerating Patient Reports with Improved Formatting")
     print("=" * 60)
     
-    # Load data and model
-    print("📥 Loading model and data...")
-    model = load_trained_model('model/model.h5')
+    # Load data
+    print("📥 Loading data...")
     train_df, test_df = load_data('data')
     
     # Select the same patients as before
     print("👥 Selecting patients...")
     np.random.seed(42)
     
+    # One pass over the diagnosis column: diagnosis -> row positions
+    idx_by_dx = test_df.groupby('diagnosis', sort=False).indices
+    
     # Patient 1: No DR (healthy)
-    patient1_candidates = test_df[test_df['diagnosis'] == 0]
+    patient1_candidates = test_df.iloc[idx_by_dx[0]]
     patient1_info = patient1_candidates.sample(1, random_state=42).iloc[0]
     
-    # Patient 2: Disease detected
-    patient2_candidates = test_df[test_df['diagnosis'].isin([2, 3, 4])]
+    # Patient 2: Disease detected (positions sorted so the pool keeps row order)
+    pool = np.sort(np.concatenate([idx_by_dx[k] for k in (2, 3, 4) if k in idx_by_dx]))
+    patient2_candidates = test_df.iloc[pool]
     patient2_info = patient2_candidates.sample(1, random_state=42).iloc[0]
     
+    patients = [patient1_info, patient2_info]
+    
+    # Patients whose artifacts are already cached skip model loading and inference
+    keys = [_cache_key(pi['id_code']) for pi in patients]
+    missing = [i for i, key in enumerate(keys)
+               if not all(p.exists() for p in _cache_paths(key))]
+    
+    images = {}
+    if missing:
+        print("📥 Loading model...")
+        # Mixed precision halves activation bandwidth, but only pays off on GPUs
+        # with fp16 support; CPUs without native BF16/fp16 would just emulate it
+        model = load_trained_model(_MODEL_PATH,
+                                   mixed_precision=bool(tf.config.list_physical_devices('GPU')))
+        
+        # Load the uncached images concurrently
+        print("🔍 Loading images...")
+        with ThreadPoolExecutor(2) as ex:
+            images = dict(zip(missing, ex.map(
+                lambda i: load_image(patients[i]['id_code'], 'data/test_images', _TARGET_SIZE),
+                missing
+            )))
+    
     output_dir = 'outputs/patient_reports'
     os.makedirs(output_dir, exist_ok=True)
     
-    for idx, patient_info in enumerate([patient1_info, patient2_info], 1):
+    for idx, patient_info in enumerate(patients, 1):
         print(f"\n🏥 Generating Report for Patient {idx}")
         print("-" * 40)
         
         patient_id = patient_info['id_code']
         print(f"Patient ID: {patient_id}")
         
-        # Load image and predict
-        image = load_image(patient_id, 'data/test_images')
-        prediction = predict_single(model, image)
+        key = keys[idx - 1]
+        overlay_path = f'{output_dir}/patient{idx}_simple_overlay.png'
+        conf_path = f'{output_dir}/patient{idx}_confidence.png'
+        
+        if idx - 1 not in images:
+            print("♻️  Using cached prediction and visualizations...")
+            prediction = _load_cached(key, overlay_path, conf_path)
+        else:
+            # Grad-CAM's forward pass doubles as the prediction
+            image = images[idx - 1]
+            heatmap, probs = get_gradcam_heatmap(model, image[np.newaxis], return_predictions=True)
+            predicted_class = int(probs.argmax())
+            prediction = {
+                'predicted_class': predicted_class,
+                'predicted_label': CLASS_NAMES[predicted_class],
+                'confidence': float(probs.max()),
+                'probabilities': probs
+            }
+            
+            # Generate visualizations
+            print("🎨 Creating visualizations...")
+            
+            # Confidence chart
+            conf_fig = generate_confidence_chart(
+                probs,
+                CLASS_NAMES,
+                save_path=conf_path
+            )
+            plt.close(conf_fig)
+            
+            # Simple overlay (title and legend are rendered by the HTML report)
+            create_simple_heatmap_overlay(
+                model, 
+                image,
+                title="What the Computer Saw in Your Eye Photo",
+                save_path=overlay_path,
+                heatmap=heatmap
+            )
+            
+            _store_cached(key, prediction, overlay_path, conf_path)
         
         predicted_class = prediction['predicted_class']
         confidence = prediction['confidence']
@@ -169,26 +302,6 @@ def regenerate_patient_reports():
         
         print(f"Prediction: {CLASS_NAMES[predicted_class]} ({confidence:.1%} confidence)")
         
-        # Generate visualizations
-        print("🎨 Creating visualizations...")
-        
-        # Confidence chart
-        conf_fig = generate_confidence_chart(
-            all_probabilities,
-            CLASS_NAMES,
-            save_path=f'{output_dir}/patient{idx}_confidence.png'
-        )
-        plt.close(conf_fig)
-        
-        # Simple overlay
-        simple_fig = create_simple_heatmap_overlay(
-            model, 
-            image,
-            title="What the Computer Saw in Your Eye Photo",
-            save_path=f'{output_dir}/patient{idx}_simple_overlay.png'
-        )
-        plt.close(simple_fig)
-        
         # Generate explanation text
         print("📝 Creating explanation...")
         explanation_text = generate_patient_explanation_text(
@@ -197,7 +310,8 @@ def regenerate_patient_reports():
         
         # Generate HTML report with improved formatting
         print("📄 Generating HTML report...")
-        html_path = generate_patient_report_html(
+        html_path = f'{output_dir}/patient{idx}_report.html'
+        generate_patient_report_html(
             patient_info=patient_info,
             prediction=prediction,
             explanation_text=explanation_text,
@@ -205,7 +319,7 @@ def regenerate_patient_reports():
                 'original': f'patient{idx}_simple_overlay.png',
                 'confidence': f'patient{idx}_confidence.png'
             },
-            output_path=f'{output_dir}/patient{idx}_report.html'
+            output_path=html_path
         )
         
         print(f"✅ Report saved: {html_path}")
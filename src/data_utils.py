@@ -3,11 +3,10 @@ Data utilities for loading and processing diabetic retinopathy data
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from PIL import Image
 import cv2
-import matplotlib.pyplot as plt
 
 
 # Diagnosis mapping
@@ -27,6 +26,12 @@ DIAGNOSIS_DESCRIPTIONS = {
     4: 'Advanced eye disease detected'
 }
 
+# Column dtypes for the train/test CSVs (columns absent from a file are ignored)
+_CSV_DTYPES = {'id_code': 'string', 'diagnosis': 'int8', 'age': 'int16', 'gender': 'category'}
+
+# uint8 -> [0, 1] float32 scale factor
+_PIXEL_SCALE = np.float32(1.0 / 255.0)
+
 
 def load_data(data_dir='data'):
     """
@@ -38,24 +43,36 @@ def load_data(data_dir='data'):
     Returns:
         train_df, test_df: DataFrames with patient information
     """
-    train_df = pd.read_csv(os.path.join(data_dir, 'train.csv'))
-    test_df = pd.read_csv(os.path.join(data_dir, 'test.csv'))
+    train_df = _read_patient_csv(os.path.join(data_dir, 'train.csv'))
+    test_df = _read_patient_csv(os.path.join(data_dir, 'test.csv'))
+    
+    # Index by id_code for O(1) patient lookups; the column is kept, and the
+    # index is left unnamed so 'id_code' stays an unambiguous column label
+    train_df = train_df.set_index('id_code', drop=False).rename_axis(None)
+    test_df = test_df.set_index('id_code', drop=False).rename_axis(None)
     
     return train_df, test_df
 
 
-def load_image(image_id, image_dir, target_size=(320, 320), add_png=True):
+def _read_patient_csv(path):
     """
-    Load and preprocess a single retinal image
+    Read a patient CSV with explicit dtypes, skipping pandas type inference
     
-    Args:
-        image_id: ID of the image (without .png extension)
-        image_dir: Directory containing images
-        target_size: Tuple of (height, width) to resize image
-        add_png: Whether to add .png extension to image_id
-        
-    Returns:
-        image: Preprocessed image as numpy array (normalized 0-1)
+    Falls back to a plain read if a column cannot be coerced (e.g. missing
+    ages would not fit in int16).
+    """
+    try:
+        return pd.read_csv(path, dtype=_CSV_DTYPES, engine='c')
+    except (ValueError, TypeError):
+        return pd.read_csv(path)
+
+
+def _read_rgb_uint8(image_id, image_dir, target_size, add_png=True):
+    """
+    Decode and resize a retinal image, returning uint8 RGB pixels
+    
+    Shared by load_image and load_batch_images so the batch path can scale
+    straight into its preallocated output buffer.
     """
     if add_png and not image_id.endswith('.png'):
         image_id = f"{image_id}.png"
@@ -65,16 +82,33 @@ def load_image(image_id, image_dir, target_size=(320, 320), add_png=True):
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image not found: {image_path}")
     
-    # Load image
-    image = Image.open(image_path).convert('RGB')
+    # Load image (OpenCV decodes to BGR)
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise FileNotFoundError(f"Could not decode image: {image_path}")
     
-    # Resize
-    image = image.resize(target_size)
+    # Resize and convert to RGB
+    image = cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def load_image(image_id, image_dir, target_size=(320, 320), add_png=True):
+    """
+    Load and preprocess a single retinal image
     
-    # Convert to numpy array and normalize
-    image = np.array(image) / 255.0
+    Args:
+        image_id: ID of the image (without .png extension)
+        image_dir: Directory containing images
+        target_size: Tuple of (height, width) to resize image
+        add_png: Whether to add .png extension to image_id
+        
+    Returns:
+        image: Preprocessed float32 image as numpy array (normalized 0-1)
+    """
+    image = _read_rgb_uint8(image_id, image_dir, target_size, add_png)
     
-    return image
+    # Normalize in float32 (half the bytes of the old float64 result)
+    return image.astype(np.float32) * _PIXEL_SCALE
 
 
 # Alias for consistency with notebook code
@@ -85,24 +119,47 @@ def load_batch_images(image_ids, image_dir, target_size=(320, 320)):
     """
     Load multiple images as a batch
     
+    Images are decoded in a thread pool (OpenCV releases the GIL while
+    decoding/resizing) and written directly into one preallocated array.
+    Images that cannot be loaded are skipped with a warning.
+    
     Args:
         image_ids: List of image IDs
         image_dir: Directory containing images
         target_size: Tuple of (height, width)
         
     Returns:
-        images: Numpy array of shape (batch_size, height, width, 3)
+        images: Float32 numpy array of shape (batch_size, height, width, 3)
+    """
+    images, loaded = _load_batch(image_ids, image_dir, target_size)
+    return images if loaded.all() else images[loaded]
+
+
+def _load_batch(image_ids, image_dir, target_size):
     """
-    images = []
-    for image_id in image_ids:
+    Decode images in parallel into a preallocated buffer
+    
+    Returns the full (n, H, W, 3) buffer and a boolean mask of which slots
+    were actually filled, so callers can keep positions aligned with ids.
+    """
+    image_ids = list(image_ids)
+    # cv2.resize takes target_size as (width, height), so rows = target_size[1]
+    images = np.empty((len(image_ids), target_size[1], target_size[0], 3), dtype=np.float32)
+    
+    def load_into(i):
         try:
-            img = load_image(image_id, image_dir, target_size)
-            images.append(img)
+            rgb = _read_rgb_uint8(image_ids[i], image_dir, target_size)
         except FileNotFoundError as e:
             print(f"Warning: {e}")
-            continue
+            return False
+        np.multiply(rgb, _PIXEL_SCALE, out=images[i])
+        return True
     
-    return np.array(images)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        loaded = np.fromiter(executor.map(load_into, range(len(image_ids))),
+                             dtype=bool, count=len(image_ids))
+    
+    return images, loaded
 
 
 def get_class_distribution(df):
@@ -153,14 +210,18 @@ def visualize_sample_images(df, image_dir, samples_per_class=2, target_size=(320
         target_size: Size to resize images
         save_path: Path to save figure (optional)
     """
+    import matplotlib.pyplot as plt  # imported lazily: pyplot start-up is slow
+    
     n_classes = df['diagnosis'].nunique()
     
     fig, axes = plt.subplots(n_classes, samples_per_class, 
-                            figsize=(4*samples_per_class, 4*n_classes))
+                            figsize=(4*samples_per_class, 4*n_classes), layout='constrained')
     
     if samples_per_class == 1:
         axes = axes.reshape(-1, 1)
     
+    # First pass: pick the samples for every class
+    rows = []
     for class_idx in range(n_classes):
         # Get samples from this class
         class_samples = df[df['diagnosis'] == class_idx].sample(n=min(samples_per_class, len(df[df['diagnosis'] == class_idx])))
@@ -168,28 +229,30 @@ def visualize_sample_images(df, image_dir, samples_per_class=2, target_size=(320
         for sample_idx, (_, row) in enumerate(class_samples.iterrows()):
             if sample_idx >= samples_per_class:
                 break
-                
-            try:
-                img = load_image(row['id_code'], image_dir, target_size, add_png=True)
-                
-                ax = axes[class_idx, sample_idx]
-                ax.imshow(img)
-                ax.axis('off')
-                
-                if sample_idx == 0:
-                    ax.set_title(f"Class {class_idx}: {DIAGNOSIS_LABELS[class_idx]}\n" + 
-                               f"Age: {row['age']}, Gender: {row['gender']}", 
-                               fontsize=10)
-                else:
-                    ax.set_title(f"Age: {row['age']}, Gender: {row['gender']}", fontsize=10)
-                    
-            except Exception as e:
-                print(f"Error loading image {row['id_code']}: {e}")
-    
-    plt.tight_layout()
+            rows.append((class_idx, sample_idx, row))
+    
+    # Decode all selected images at once, in parallel
+    imgs, loaded = _load_batch([row['id_code'] for _, _, row in rows], image_dir, target_size)
+    
+    # Second pass: fill the axes
+    for k, (class_idx, sample_idx, row) in enumerate(rows):
+        if not loaded[k]:
+            print(f"Error loading image {row['id_code']}")
+            continue
+        
+        ax = axes[class_idx, sample_idx]
+        ax.imshow(imgs[k])
+        ax.axis('off')
+        
+        if sample_idx == 0:
+            ax.set_title(f"Class {class_idx}: {DIAGNOSIS_LABELS[class_idx]}\n" + 
+                       f"Age: {row['age']}, Gender: {row['gender']}", 
+                       fontsize=10)
+        else:
+            ax.set_title(f"Age: {row['age']}, Gender: {row['gender']}", fontsize=10)
     
     if save_path:
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        fig.savefig(save_path, dpi=150)
         print(f"Saved sample images to {save_path}")
     
     plt.show()
@@ -209,12 +272,18 @@ def get_patient_info(patient_id, df):
     # Remove .png if present
     patient_id = patient_id.replace('.png', '')
     
-    patient_row = df[df['id_code'] == patient_id]
-    
-    if len(patient_row) == 0:
-        return None
+    try:
+        # Hash lookup on frames indexed by id_code (see load_data)
+        patient_row = df.loc[patient_id]
+    except KeyError:
+        # Frames with another index fall back to a column scan
+        patient_row = df[df['id_code'] == patient_id]
+        if len(patient_row) == 0:
+            return None
     
-    patient_row = patient_row.iloc[0]
+    # Duplicate ids (or the scan above) give a frame; use the first row
+    if isinstance(patient_row, pd.DataFrame):
+        patient_row = patient_row.iloc[0]
     
     patient_info = {
         'id': patient_row['id_code'],
@@ -2,33 +2,92 @@
 Explanation utilities using SHAP, Grad-CAM, and other explainability techniques
 """
 
+import weakref
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-import matplotlib.pyplot as plt
 import cv2
-from matplotlib.colors import LinearSegmentedColormap
 
+try:
+    import numba
+except ImportError:
+    numba = None
 
-def get_gradcam_heatmap(model, image, pred_class=None, last_conv_layer_name=None):
+
+# model -> {layer name: traced Grad-CAM function}; entries go away with the model
+_GRADCAM_CACHE: "weakref.WeakKeyDictionary[keras.Model, dict]" = weakref.WeakKeyDictionary()
+
+# model -> name of its last convolutional layer
+_LAST_CONV_CACHE: "weakref.WeakKeyDictionary[keras.Model, str]" = weakref.WeakKeyDictionary()
+
+# Legend for the simple patient overlay (the HTML report shows it as a caption)
+_SIMPLE_OVERLAY_LEGEND = ("Red/yellow areas = where the computer looked most closely\n"
+                          "Blue/green areas = normal areas")
+
+# Generator for SHAP background sampling (thread-safe, no global RandomState lock)
+_SHAP_RNG = np.random.default_rng(0)
+
+# 256-entry RGB lookup table for the default (jet) heatmap colormap
+_JET_RGB_LUT = cv2.cvtColor(
+    cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET),
+    cv2.COLOR_BGR2RGB
+).reshape(256, 1, 3)
+
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True, parallel=True)
+    def _gradcam_combine(conv, pooled):
+        """Fused (H, W, C) @ (C,) weighting, ReLU and max-normalize -> (H, W) float32"""
+        H, W, C = conv.shape
+        out = np.zeros((H, W), dtype=np.float32)
+        for i in numba.prange(H):
+            for j in range(W):
+                s = 0.0
+                for c in range(C):
+                    s += conv[i, j, c] * pooled[c]
+                out[i, j] = s if s > 0.0 else 0.0
+        m = out.max()
+        if m > 0.0:
+            out /= m
+        return out
+else:
+    def _gradcam_combine(conv, pooled):
+        """NumPy fallback for the fused Grad-CAM weighting/ReLU/normalize"""
+        out = np.maximum(conv @ pooled, np.float32(0))
+        m = out.max()
+        if m > 0:
+            out /= m
+        return out
+
+
+def _find_last_conv(model):
     """
-    Generate Grad-CAM heatmap for an image
+    Find (and remember) the name of the last 4D-output layer of a model
     
     Args:
-        model: Trained Keras model
-        image: Preprocessed image (with batch dimension)
-        pred_class: Target class for Grad-CAM (if None, uses predicted class)
-        last_conv_layer_name: Name of last convolutional layer
+        model: Keras model
         
     Returns:
-        heatmap: Grad-CAM heatmap as numpy array
+        Layer name, or None if the model has no convolutional output
     """
-    # Find last convolutional layer if not specified
-    if last_conv_layer_name is None:
-        for layer in reversed(model.layers):
-            if len(layer.output_shape) == 4:  # Convolutional layer
-                last_conv_layer_name = layer.name
-                break
+    for layer in reversed(model.layers):
+        if len(layer.output_shape) == 4:  # Convolutional layer
+            _LAST_CONV_CACHE[model] = layer.name
+            return layer.name
+    return None
+
+
+def _get_gradcam_fn(model, last_conv_layer_name):
+    """
+    Return the cached, traced Grad-CAM gradient function for a model/layer pair
+    
+    Building the (input -> [conv, predictions]) sub-model walks the whole layer
+    graph, so it is done once per model/layer and the tape computation is
+    traced into an XLA-compiled tf.function alongside it.
+    """
+    fns = _GRADCAM_CACHE.setdefault(model, {})
+    if last_conv_layer_name in fns:
+        return fns[last_conv_layer_name]
     
     # Create model that maps input to last conv layer + predictions
     grad_model = keras.Model(
@@ -36,28 +95,69 @@ def get_gradcam_heatmap(model, image, pred_class=None, last_conv_layer_name=None
         outputs=[model.get_layer(last_conv_layer_name).output, model.output]
     )
     
-    # Compute gradient
-    with tf.GradientTape() as tape:
-        conv_outputs, predictions = grad_model(image)
-        if pred_class is None:
-            pred_class = tf.argmax(predictions[0])
-        class_channel = predictions[:, pred_class]
+    @tf.function(input_signature=[
+        tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32),
+        tf.TensorSpec([], tf.int64)
+    ], jit_compile=True)
+    def compute(image, pred_class):
+        # Compute gradient
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = grad_model(image)
+            # Under a mixed_float16 policy, score in float32 (fp16 softmax is imprecise)
+            predictions = tf.cast(predictions, tf.float32)
+            # A negative class means "explain the predicted class"
+            pred_class = tf.where(pred_class < 0, tf.argmax(predictions[0]), pred_class)
+            class_channel = tf.gather(predictions, pred_class, axis=1)
+        
+        # Gradient of class output with respect to feature map
+        grads = tape.gradient(class_channel, conv_outputs)
+        
+        # Mean intensity of gradient over specific feature map channel
+        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+        
+        return (tf.cast(conv_outputs[0], tf.float32), tf.cast(pooled_grads, tf.float32),
+                predictions[0])
     
-    # Gradient of class output with respect to feature map
-    grads = tape.gradient(class_channel, conv_outputs)
+    fns[last_conv_layer_name] = compute
+    return compute
+
+
+def get_gradcam_heatmap(model, image, pred_class=None, last_conv_layer_name=None,
+                        return_predictions=False):
+    """
+    Generate Grad-CAM heatmap for an image
     
-    # Mean intensity of gradient over specific feature map channel
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+    Args:
+        model: Trained Keras model
+        image: Preprocessed image (with batch dimension)
+        pred_class: Target class for Grad-CAM (if None, uses predicted class)
+        last_conv_layer_name: Name of last convolutional layer
+        return_predictions: Also return the class probabilities from the
+            Grad-CAM forward pass, so callers can skip a separate predict
+        
+    Returns:
+        heatmap: Grad-CAM heatmap as numpy array
+        (heatmap, probabilities) if return_predictions is True
+    """
+    # Find last convolutional layer if not specified
+    if last_conv_layer_name is None:
+        last_conv_layer_name = _LAST_CONV_CACHE.get(model) or _find_last_conv(model)
     
-    # Multiply each channel by "importance"
-    conv_outputs = conv_outputs[0]
-    heatmap = conv_outputs @ pooled_grads[..., tf.newaxis]
-    heatmap = tf.squeeze(heatmap)
+    compute = _get_gradcam_fn(model, last_conv_layer_name)
+    conv_outputs, pooled_grads, predictions = compute(
+        tf.convert_to_tensor(image, dtype=tf.float32),
+        tf.constant(-1 if pred_class is None else int(pred_class), dtype=tf.int64)
+    )
     
-    # Normalize heatmap
-    heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
+    # Weight channels by "importance", ReLU and normalize in one fused pass
+    heatmap = _gradcam_combine(
+        np.ascontiguousarray(conv_outputs.numpy(), dtype=np.float32),
+        np.ascontiguousarray(pooled_grads.numpy(), dtype=np.float32)
+    )
     
-    return heatmap.numpy()
+    if return_predictions:
+        return heatmap, predictions.numpy()
+    return heatmap
 
 
 def overlay_heatmap(image, heatmap, alpha=0.4, colormap=cv2.COLORMAP_JET):
@@ -71,25 +171,29 @@ def overlay_heatmap(image, heatmap, alpha=0.4, colormap=cv2.COLORMAP_JET):
         colormap: OpenCV colormap to use
         
     Returns:
-        overlaid_image: Image with heatmap overlay
+        overlaid_image: Image with heatmap overlay (uint8 RGB)
     """
-    # Resize heatmap to match image size
-    heatmap = cv2.resize(heatmap, (image.shape[1], image.shape[0]))
-    
-    # Convert heatmap to RGB
-    heatmap = np.uint8(255 * heatmap)
-    heatmap = cv2.applyColorMap(heatmap, colormap)
-    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
-    heatmap = heatmap / 255.0
+    # Resize the small conv-resolution heatmap straight to image size
+    hm = cv2.resize(np.asarray(heatmap, dtype=np.float32),
+                    (image.shape[1], image.shape[0]), interpolation=cv2.INTER_LINEAR)
+    
+    # Convert heatmap to RGB (convertScaleAbs scales and saturates to uint8 in one pass)
+    hm_u8 = cv2.convertScaleAbs(hm, alpha=255.0)
+    if colormap == cv2.COLORMAP_JET:
+        # Precomputed RGB table: one lookup pass, no BGR->RGB conversion
+        colored = cv2.LUT(cv2.merge([hm_u8, hm_u8, hm_u8]), _JET_RGB_LUT)
+    else:
+        colored = cv2.cvtColor(cv2.applyColorMap(hm_u8, colormap), cv2.COLOR_BGR2RGB)
     
-    # Convert image to 0-1 range if needed
-    if image.max() > 1.0:
-        image = image / 255.0
+    # Avoid carrying float64 images (e.g. from older loaders) through the conversion
+    if image.dtype != np.float32 and image.dtype != np.uint8:
+        image = image.astype(np.float32, copy=False)
     
-    # Overlay
-    overlaid_image = heatmap * alpha + image * (1 - alpha)
+    # Bring the image to uint8 as well, scaling up if it is normalized 0-1
+    img_u8 = cv2.convertScaleAbs(image, alpha=255.0 if image.max() <= 1.0 else 1.0)
     
-    return overlaid_image
+    # Single fused blend
+    return cv2.addWeighted(colored, alpha, img_u8, 1 - alpha, 0)
 
 
 def create_gradcam_visualization(model, image, save_path=None, pred_class=None):
@@ -105,6 +209,8 @@ def create_gradcam_visualization(model, image, save_path=None, pred_class=None):
     Returns:
         fig: Matplotlib figure
     """
+    import matplotlib.pyplot as plt  # imported lazily: pyplot start-up is slow
+    
     # Ensure batch dimension
     if len(image.shape) == 3:
         image_batch = np.expand_dims(image, axis=0)
@@ -119,7 +225,7 @@ def create_gradcam_visualization(model, image, save_path=None, pred_class=None):
     overlay = overlay_heatmap(image, heatmap)
     
     # Create visualization
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+    fig, axes = plt.subplots(1, 3, figsize=(15, 5), layout='constrained')
     
     # Original image
     axes[0].imshow(image)
@@ -136,27 +242,31 @@ def create_gradcam_visualization(model, image, save_path=None, pred_class=None):
     axes[2].set_title('Overlay', fontsize=14)
     axes[2].axis('off')
     
-    plt.tight_layout()
-    
     if save_path:
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        fig.savefig(save_path, dpi=150)
         print(f"Saved Grad-CAM visualization to {save_path}")
     
     return fig
 
 
-def create_simple_heatmap_overlay(model, image, title="What the Computer Saw", save_path=None):
+def create_simple_heatmap_overlay(model, image, title="What the Computer Saw", save_path=None,
+                                  heatmap=None):
     """
     Create simple heatmap overlay for patient reports (8th grade level)
     
+    The overlay is written straight to PNG; the title and colour legend are
+    rendered by the HTML report instead of being drawn into the image. Use
+    _mpl_wrap to get the old Matplotlib figure layout.
+    
     Args:
         model: Trained model
         image: Input image
-        title: Title for the plot
+        title: Title for the plot (kept for _mpl_wrap callers)
         save_path: Path to save
+        heatmap: Precomputed Grad-CAM heatmap (computed from the model if None)
         
     Returns:
-        fig: Matplotlib figure
+        overlay: Overlay image as uint8 RGB numpy array
     """
     # Ensure batch dimension
     if len(image.shape) == 3:
@@ -166,27 +276,40 @@ def create_simple_heatmap_overlay(model, image, title="What the Computer Saw", s
         image = image[0]
     
     # Generate heatmap
-    heatmap = get_gradcam_heatmap(model, image_batch)
+    if heatmap is None:
+        heatmap = get_gradcam_heatmap(model, image_batch)
     overlay = overlay_heatmap(image, heatmap, alpha=0.5)
     
-    # Create simple visualization
-    fig, ax = plt.subplots(1, 1, figsize=(8, 8))
+    if save_path:
+        cv2.imwrite(save_path, cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        print(f"Saved simple heatmap to {save_path}")
+    
+    return overlay
+
+
+def _mpl_wrap(overlay, title="What the Computer Saw", caption=_SIMPLE_OVERLAY_LEGEND):
+    """
+    Render an overlay with a title and caption box as a Matplotlib figure
+    
+    Args:
+        overlay: Overlay image from create_simple_heatmap_overlay
+        title: Title for the plot
+        caption: Explanation text shown under the image
+        
+    Returns:
+        fig: Matplotlib figure
+    """
+    import matplotlib.pyplot as plt
+    
+    fig, ax = plt.subplots(1, 1, figsize=(8, 8), layout='constrained')
     ax.imshow(overlay)
     ax.set_title(title, fontsize=16, fontweight='bold')
     ax.axis('off')
     
-    # Add explanation text
-    explanation_text = ("Red/yellow areas = where the computer looked most closely\n"
-                       "Blue/green areas = normal areas")
-    fig.text(0.5, 0.02, explanation_text, ha='center', fontsize=12, 
+    fig.text(0.5, 0.02, caption, ha='center', fontsize=12, 
              bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
     
-    plt.tight_layout()
-    
-    if save_path:
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
-        print(f"Saved simple heatmap to {save_path}")
-    
     return fig
 
 
@@ -202,55 +325,56 @@ def generate_confidence_chart(probabilities, class_names, save_path=None):
     Returns:
         fig: Matplotlib figure
     """
+    import matplotlib.pyplot as plt
+    
     if isinstance(probabilities, dict):
         probs = [probabilities[name] for name in class_names]
     else:
         probs = probabilities
     
-    # Convert to percentages
-    probs_pct = [p * 100 for p in probs]
+    # Convert to percentages; exactly one bar (the first maximum) is highlighted
+    probs_arr = np.asarray(probs, dtype=np.float32) * 100.0
+    max_i = int(probs_arr.argmax())
+    colors = np.where(np.arange(len(probs_arr)) == max_i, 'green', 'lightblue').tolist()
     
     # Create bar chart
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig, ax = plt.subplots(figsize=(10, 6), layout='constrained')
     
-    colors = ['green' if p == max(probs_pct) else 'lightblue' for p in probs_pct]
-    bars = ax.barh(class_names, probs_pct, color=colors)
+    bars = ax.barh(class_names, probs_arr, color=colors)
     
     # Add percentage labels
-    for i, (bar, pct) in enumerate(zip(bars, probs_pct)):
+    for i, (bar, pct) in enumerate(zip(bars, probs_arr)):
         ax.text(pct + 2, i, f'{pct:.1f}%', va='center', fontweight='bold')
     
     ax.set_xlabel('Confidence (%)', fontsize=12)
     ax.set_title('How Sure is the Computer?', fontsize=14, fontweight='bold')
     ax.set_xlim(0, 110)
     
-    plt.tight_layout()
-    
     if save_path:
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        fig.savefig(save_path, dpi=100)
         print(f"Saved confidence chart to {save_path}")
     
     return fig
 
 
-def prepare_shap_background(images, max_samples=50):
+def prepare_shap_background(images, max_samples=50, seed=None):
     """
     Prepare background dataset for SHAP analysis
     
     Args:
         images: Array of images
         max_samples: Maximum number of samples for background
+        seed: Optional seed for a reproducible subset (defaults to the module generator)
         
     Returns:
         background: Background dataset for SHAP
     """
-    if len(images) > max_samples:
-        indices = np.random.choice(len(images), max_samples, replace=False)
-        background = images[indices]
-    else:
-        background = images
+    if len(images) <= max_samples:
+        return images
     
-    return background
+    rng = _SHAP_RNG if seed is None else np.random.default_rng(seed)
+    indices = rng.permutation(len(images))[:max_samples]
+    return images[indices]
 
 
 def explain_prediction_simple(predicted_class, confidence, heatmap_focus):
@@ -3,11 +3,44 @@ HTML and PDF generation utilities for creating patient reports and handbooks
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import matplotlib.pyplot as plt
+from functools import lru_cache
+from string import Template
 import re
 
 
+# Line classifier for format_explanation_text_to_html. Every alternative is a
+# zero-width lookahead matched at the start of the line, so the first one that
+# applies wins, in the same priority order as the original if/elif chain.
+_LINE_CLS = re.compile(
+    r'(?P<bullet>(?=[•✓⚠]))'
+    r'|(?P<sep>(?=[=\-]))'
+    r'|(?P<pos>(?=.*(?:✓|Good News)))'
+    r'|(?P<warn>(?=.*(?:⚠|Warning|Detected)))'
+)
+
+# Lowest-priority paragraph class, checked only when _LINE_CLS finds nothing;
+# a plain literal search uses re's fast substring scan and allocates nothing
+_CONFIDENT_RE = re.compile(r'confident', re.IGNORECASE)
+
+_PARAGRAPH_CLASSES = {
+    'pos': 'positive-result',
+    'warn': 'warning-result',
+    'conf': 'confidence-text',
+}
+
+# ASCII equivalent of str.isupper(): at least one capital, no lowercase letters
+_HEADER_RE = re.compile(r'[^a-z]*[A-Z][^a-z]*\Z')
+
+
+def _is_header(line):
+    """str.isupper() with a regex fast path for ASCII lines (isascii() is O(1))"""
+    if line.isascii():
+        return _HEADER_RE.match(line) is not None
+    return line.isupper()
+
+
 def format_explanation_text_to_html(explanation_text):
     """
     Convert plain text explanation to properly formatted HTML
@@ -18,11 +51,17 @@ def format_explanation_text_to_html(explanation_text):
     Returns:
         str: HTML formatted explanation
     """
-    html = ""
+    parts = []
     lines = explanation_text.split('\n')
     current_section = None
     in_list = False
     
+    # Hoist attribute/global lookups out of the per-line loop
+    append = parts.append
+    classify = _LINE_CLS.match
+    find_confident = _CONFIDENT_RE.search
+    paragraph_class = _PARAGRAPH_CLASSES.get
+    
     for line in lines:
         line = line.strip()
         
@@ -34,121 +73,89 @@ def format_explanation_text_to_html(explanation_text):
             continue  # Skip this as we already have a header
             
         # Section headers (lines with all caps followed by dashes)
-        if line.isupper() and len(line) > 3 and not line.startswith('•'):
+        if len(line) > 3 and _is_header(line) and not line.startswith('•'):
             if in_list:
-                html += "</ul>\n"
+                append("</ul>\n")
                 in_list = False
                 
-            if line.startswith('=') or line.startswith('-'):
+            if line.startswith(('=', '-')):
                 continue  # Skip separator lines
                 
-            html += f'<div class="explanation-section"><h3 class="section-header">{line}</h3>\n'
+            append(f'<div class="explanation-section"><h3 class="section-header">{line}</h3>\n')
             current_section = line
-            
+            continue
+        
+        # One regex match classifies everything else (see _LINE_CLS)
+        m = classify(line)
+        if m is not None:
+            kind = m.lastgroup
+        else:
+            kind = 'conf' if find_confident(line) is not None else None
+        
         # Bullet points
-        elif line.startswith('•') or line.startswith('✓') or line.startswith('⚠'):
+        if kind == 'bullet':
             if not in_list:
-                html += '<ul class="explanation-list">\n'
+                append('<ul class="explanation-list">\n')
                 in_list = True
             icon = line[0]
             content = line[1:].strip()
-            html += f'<li><span class="list-icon">{icon}</span> {content}</li>\n'
+            append(f'<li><span class="list-icon">{icon}</span> {content}</li>\n')
             
-        # Regular paragraphs
-        elif line and not line.startswith('=') and not line.startswith('-'):
+        # Regular paragraphs (separator lines are skipped)
+        elif kind != 'sep':
             if in_list:
-                html += "</ul>\n"
+                append("</ul>\n")
                 in_list = False
                 
             # Check for special formatting
-            if '✓' in line or 'Good News' in line:
-                html += f'<p class="positive-result">{line}</p>\n'
-            elif '⚠' in line or 'Warning' in line or 'Detected' in line:
-                html += f'<p class="warning-result">{line}</p>\n'
-            elif 'confident' in line.lower():
-                html += f'<p class="confidence-text">{line}</p>\n'
-            else:
-                html += f'<p class="explanation-paragraph">{line}</p>\n'
+            css_class = paragraph_class(kind, 'explanation-paragraph')
+            append(f'<p class="{css_class}">{line}</p>\n')
     
     if in_list:
-        html += "</ul>\n"
+        append("</ul>\n")
         
     if current_section:
-        html += "</div>\n"
+        append("</div>\n")
         
-    return html
-import re
+    return "".join(parts)
 
 
-def format_explanation_text_to_html(explanation_text):
+# Output directories already created by this process
+_ENSURED_DIRS = set()
+
+
+def _ensure_dir(d):
+    """os.makedirs(d, exist_ok=True), but only once per directory per process"""
+    d = d or '.'
+    if d not in _ENSURED_DIRS:
+        os.makedirs(d, exist_ok=True)
+        _ENSURED_DIRS.add(d)
+
+
+# Legacy {{PLACEHOLDER}} markers, converted to ${PLACEHOLDER} when a template loads
+_PH_RE = re.compile(
+    r'\{\{(PATIENT_ID|PATIENT_AGE|PATIENT_GENDER|SCREENING_DATE|DIAGNOSIS|CONFIDENCE'
+    r'|IMAGE_PATH|HEATMAP_PATH|CONFIDENCE_CHART_PATH|EXPLANATION|NEXT_STEPS)\}\}'
+)
+
+
+@lru_cache(maxsize=4)
+def _load_template(path):
     """
-    Convert plain text explanation to properly formatted HTML
+    Read and compile a report template, falling back to the built-in default
     
-    Args:
-        explanation_text (str): Plain text explanation with sections and formatting
-        
-    Returns:
-        str: HTML formatted explanation
+    Template files may still use {{PLACEHOLDER}} markers; these are rewritten to
+    string.Template's braced ${PLACEHOLDER} form (with literal '$' escaped) once
+    here, so a marker followed by a word character still names the same key.
     """
-    html = ""
-    lines = explanation_text.split('\n')
-    current_section = None
-    in_list = False
-    
-    for line in lines:
-        line = line.strip()
-        
-        if not line:
-            continue
-            
-        # Main title
-        if line == "EYE SCREENING REPORT":
-            continue  # Skip this as we already have a header
-            
-        # Section headers (lines with all caps followed by dashes)
-        if line.isupper() and len(line) > 3 and not line.startswith('•'):
-            if in_list:
-                html += "</ul>\n"
-                in_list = False
-                
-            if line.startswith('=') or line.startswith('-'):
-                continue  # Skip separator lines
-                
-            html += f'<div class="explanation-section"><h3 class="section-header">{line}</h3>\n'
-            current_section = line
-            
-        # Bullet points
-        elif line.startswith('•') or line.startswith('✓') or line.startswith('⚠'):
-            if not in_list:
-                html += '<ul class="explanation-list">\n'
-                in_list = True
-            icon = line[0]
-            content = line[1:].strip()
-            html += f'<li><span class="list-icon">{icon}</span> {content}</li>\n'
-            
-        # Regular paragraphs
-        elif line and not line.startswith('=') and not line.startswith('-'):
-            if in_list:
-                html += "</ul>\n"
-                in_list = False
-                
-            # Check for special formatting
-            if '✓' in line or 'Good News' in line:
-                html += f'<p class="positive-result">{line}</p>\n'
-            elif '⚠' in line or 'Warning' in line or 'Detected' in line:
-                html += f'<p class="warning-result">{line}</p>\n'
-            elif 'confident' in line.lower():
-                html += f'<p class="confidence-text">{line}</p>\n'
-            else:
-                html += f'<p class="explanation-paragraph">{line}</p>\n'
-    
-    if in_list:
-        html += "</ul>\n"
-        
-    if current_section:
-        html += "</div>\n"
-        
-    return html
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            source = f.read()
+        source = _PH_RE.sub(r'${\1}', source.replace('$', '$$'))
+    else:
+        # Use default template if file doesn't exist
+        source = get_default_patient_template()
+    return Template(source)
 
 
 def generate_patient_html(patient_info, prediction, image_path, heatmap_path, 
@@ -169,36 +176,29 @@ def generate_patient_html(patient_info, prediction, image_path, heatmap_path,
     Returns:
         html_content: Generated HTML string
     """
-    # Read template
-    if os.path.exists(template_path):
-        with open(template_path, 'r') as f:
-            html = f.read()
-    else:
-        # Use default template if file doesn't exist
-        html = get_default_patient_template()
-    
-    # Replace placeholders
-    replacements = {
-        '{{PATIENT_ID}}': patient_info.get('id', 'Unknown'),
-        '{{PATIENT_AGE}}': str(patient_info.get('age', 'N/A')),
-        '{{PATIENT_GENDER}}': patient_info.get('gender', 'N/A'),
-        '{{SCREENING_DATE}}': datetime.now().strftime('%B %d, %Y'),
-        '{{DIAGNOSIS}}': prediction['predicted_label'],
-        '{{CONFIDENCE}}': f"{int(prediction['confidence'] * 100)}%",
-        '{{IMAGE_PATH}}': image_path,
-        '{{HEATMAP_PATH}}': heatmap_path,
-        '{{CONFIDENCE_CHART_PATH}}': confidence_chart_path,
-        '{{EXPLANATION}}': get_patient_explanation(prediction, patient_info),
-        '{{NEXT_STEPS}}': get_next_steps(prediction['predicted_class'], prediction['confidence'])
-    }
-    
-    for placeholder, value in replacements.items():
-        html = html.replace(placeholder, value)
+    # Read template (cached after the first call)
+    template = _load_template(template_path)
+    
+    # Fill all placeholders in a single pass
+    html = template.substitute(
+        PATIENT_ID=patient_info.get('id', 'Unknown'),
+        PATIENT_AGE=str(patient_info.get('age', 'N/A')),
+        PATIENT_GENDER=patient_info.get('gender', 'N/A'),
+        SCREENING_DATE=datetime.now().strftime('%B %d, %Y'),
+        DIAGNOSIS=prediction['predicted_label'],
+        CONFIDENCE=f"{int(prediction['confidence'] * 100)}%",
+        IMAGE_PATH=image_path,
+        HEATMAP_PATH=heatmap_path,
+        CONFIDENCE_CHART_PATH=confidence_chart_path,
+        EXPLANATION=get_patient_explanation(prediction, patient_info),
+        NEXT_STEPS=get_next_steps(prediction['predicted_class'], prediction['confidence'])
+    )
     
     # Save if output path provided
     if output_path:
-        with open(output_path, 'w') as f:
-            f.write(html)
+        _ensure_dir(os.path.dirname(output_path))
+        with open(output_path, 'wb') as f:
+            f.write(html.encode('utf-8'))
         print(f"Saved patient report to {output_path}")
     
     return html
@@ -290,33 +290,33 @@ def get_default_patient_template():
     <div class="section">
         <div class="info-grid">
             <div class="info-label">Patient ID:</div>
-            <div>{{PATIENT_ID}}</div>
+            <div>$PATIENT_ID</div>
             <div class="info-label">Age:</div>
-            <div>{{PATIENT_AGE}}</div>
+            <div>$PATIENT_AGE</div>
             <div class="info-label">Gender:</div>
-            <div>{{PATIENT_GENDER}}</div>
+            <div>$PATIENT_GENDER</div>
             <div class="info-label">Screening Date:</div>
-            <div>{{SCREENING_DATE}}</div>
+            <div>$SCREENING_DATE</div>
         </div>
     </div>
     
     <div class="result-box">
         <h2 style="margin-top: 0;">YOUR RESULT</h2>
-        <p style="font-size: 24px; font-weight: bold; margin: 10px 0;">{{DIAGNOSIS}}</p>
-        <p>Confidence: The computer is {{CONFIDENCE}} sure about this result.</p>
+        <p style="font-size: 24px; font-weight: bold; margin: 10px 0;">$DIAGNOSIS</p>
+        <p>Confidence: The computer is $CONFIDENCE sure about this result.</p>
     </div>
     
     <div class="section">
         <div class="section-title">YOUR EYE PHOTO</div>
         <div class="image-container">
-            <img src="{{IMAGE_PATH}}" alt="Eye Photo">
+            <img src="$IMAGE_PATH" alt="Eye Photo">
         </div>
     </div>
     
     <div class="section">
         <div class="section-title">WHAT THE COMPUTER SAW</div>
         <div class="image-container">
-            <img src="{{HEATMAP_PATH}}" alt="Analysis">
+            <img src="$HEATMAP_PATH" alt="Analysis">
         </div>
         <p style="text-align: center; color: #666;">
             <strong>Colored areas show where the computer looked most closely:</strong><br>
@@ -327,18 +327,18 @@ def get_default_patient_template():
     <div class="section">
         <div class="section-title">HOW SURE IS THE RESULT?</div>
         <div class="image-container">
-            <img src="{{CONFIDENCE_CHART_PATH}}" alt="Confidence">
+            <img src="$CONFIDENCE_CHART_PATH" alt="Confidence">
         </div>
     </div>
     
     <div class="section">
         <div class="section-title">WHAT THIS MEANS FOR YOU</div>
-        {{EXPLANATION}}
+        $EXPLANATION
     </div>
     
     <div class="section">
         <div class="section-title">WHAT TO DO NEXT</div>
-        {{NEXT_STEPS}}
+        $NEXT_STEPS
     </div>
     
     <div class="important-note">
@@ -356,97 +356,81 @@ def get_default_patient_template():
     return template
 
 
-def get_patient_explanation(prediction, patient_info):
-    """
-    Generate patient-friendly explanation based on prediction
-    """
-    predicted_class = prediction['predicted_class']
-    confidence = prediction['confidence']
-    confidence_pct = int(confidence * 100)
-    
-    explanations = {
-        0: f"""
+# Per-class (explanation template, next-steps HTML) for patient reports; the
+# explanation takes a {pct} placeholder and only the selected entry is formatted
+_PATIENT_COPY = (
+    (
+        """
         <p>✓ <strong>Good news!</strong> Your eyes look healthy right now.</p>
         <p>The screening tool looked at your eye photo. It checked the blood vessels and other 
         parts of your eye. Everything looks normal and healthy.</p>
-        <p>The computer is {confidence_pct}% confident about this result.</p>
+        <p>The computer is {pct}% confident about this result.</p>
         """,
-        1: f"""
-        <p>⚠️ The screening found some <strong>early changes</strong> in your eye.</p>
-        <p>This means there are small signs of diabetic eye disease. These are very early signs 
-        and can be managed with good diabetes care.</p>
-        <p>The computer is {confidence_pct}% confident about this result.</p>
-        """,
-        2: f"""
-        <p>⚠️ The screening found <strong>changes in your eye</strong> that need attention.</p>
-        <p>There are signs that diabetes is affecting the blood vessels in your eye. This does 
-        NOT mean you will go blind. Treatment can prevent vision loss.</p>
-        <p>The computer is {confidence_pct}% confident about this result.</p>
-        """,
-        3: f"""
-        <p>⚠️ The screening found <strong>serious changes</strong> in your eye.</p>
-        <p>There are significant signs that diabetes has damaged the blood vessels in your eye. 
-        It's important to see an eye doctor soon. Treatment can protect your vision.</p>
-        <p>The computer is {confidence_pct}% confident about this result.</p>
-        """,
-        4: f"""
-        <p>⚠️ The screening found <strong>advanced changes</strong> in your eye.</p>
-        <p>There are serious signs that diabetes has caused significant damage to your eye. 
-        You need to see an eye doctor right away. Early treatment is very important to prevent vision loss.</p>
-        <p>The computer is {confidence_pct}% confident about this result.</p>
-        """
-    }
-    
-    explanation = explanations.get(predicted_class, explanations[0])
-    
-    # Add low confidence warning if needed
-    if confidence < 0.7:
-        explanation += """
-        <p><strong>Note:</strong> Because the computer is less sure about this result, 
-        a nurse or doctor should review it carefully.</p>
         """
-    
-    return explanation
-
-
-def get_next_steps(predicted_class, confidence):
-    """
-    Generate next steps recommendations based on prediction
-    """
-    next_steps = {
-        0: """
         <ul>
             <li><strong>Keep managing your diabetes</strong> with your regular doctor</li>
             <li><strong>Come back for another screening in 1 year</strong></li>
             <li><strong>Tell your doctor if your vision changes</strong> (blurry vision, spots, etc.)</li>
             <li><strong>Control your blood sugar, blood pressure, and cholesterol</strong></li>
         </ul>
+        """
+    ),
+    (
+        """
+        <p>⚠️ The screening found some <strong>early changes</strong> in your eye.</p>
+        <p>This means there are small signs of diabetic eye disease. These are very early signs 
+        and can be managed with good diabetes care.</p>
+        <p>The computer is {pct}% confident about this result.</p>
         """,
-        1: """
+        """
         <ul>
             <li><strong>See an eye doctor within 6-12 months</strong> to check your eyes</li>
             <li><strong>Keep your blood sugar under control</strong> - this is very important</li>
             <li><strong>Monitor your vision</strong> - tell your doctor about any changes</li>
             <li><strong>Don't worry</strong> - early detection means you can prevent problems</li>
         </ul>
+        """
+    ),
+    (
+        """
+        <p>⚠️ The screening found <strong>changes in your eye</strong> that need attention.</p>
+        <p>There are signs that diabetes is affecting the blood vessels in your eye. This does 
+        NOT mean you will go blind. Treatment can prevent vision loss.</p>
+        <p>The computer is {pct}% confident about this result.</p>
         """,
-        2: """
+        """
         <ul>
             <li><strong>See an eye doctor within 3-6 months</strong> for a detailed eye exam</li>
             <li><strong>Work closely with your diabetes doctor</strong> to control blood sugar</li>
             <li><strong>The eye doctor may recommend treatment</strong> to prevent vision loss</li>
             <li><strong>Don't panic</strong> - treatment at this stage is very effective</li>
         </ul>
+        """
+    ),
+    (
+        """
+        <p>⚠️ The screening found <strong>serious changes</strong> in your eye.</p>
+        <p>There are significant signs that diabetes has damaged the blood vessels in your eye. 
+        It's important to see an eye doctor soon. Treatment can protect your vision.</p>
+        <p>The computer is {pct}% confident about this result.</p>
         """,
-        3: """
+        """
         <ul>
             <li><strong>See an eye doctor within 1-2 months</strong> - this is important</li>
             <li><strong>Treatment will likely be needed</strong> to protect your vision</li>
             <li><strong>Keep your blood sugar as controlled as possible</strong></li>
             <li><strong>Follow your eye doctor's advice closely</strong></li>
         </ul>
+        """
+    ),
+    (
+        """
+        <p>⚠️ The screening found <strong>advanced changes</strong> in your eye.</p>
+        <p>There are serious signs that diabetes has caused significant damage to your eye. 
+        You need to see an eye doctor right away. Early treatment is very important to prevent vision loss.</p>
+        <p>The computer is {pct}% confident about this result.</p>
         """,
-        4: """
+        """
         <ul>
             <li><strong>See an eye doctor within 2 weeks</strong> - this is urgent</li>
             <li><strong>Treatment is needed soon</strong> to prevent serious vision loss</li>
@@ -454,130 +438,140 @@ def get_next_steps(predicted_class, confidence):
             <li><strong>Bring this report</strong> when you see the eye doctor</li>
         </ul>
         """
-    }
-    
-    steps = next_steps.get(predicted_class, next_steps[0])
-    
-    return steps
+    ),
+)
 
 
-def generate_patient_report_html(patient_info, prediction, explanation_text, 
-                                  image_paths, output_path):
+def _patient_copy(predicted_class):
+    """Table entry for a class; unknown classes fall back to class 0"""
+    if 0 <= predicted_class < len(_PATIENT_COPY):
+        return _PATIENT_COPY[predicted_class]
+    return _PATIENT_COPY[0]
+
+
+def get_patient_explanation(prediction, patient_info):
     """
-    Generate HTML report for a patient with SHAP explanations
-    
-    Args:
-        patient_info: Pandas Series or dict with patient information (id_code, age, gender, diagnosis)
-        prediction: Prediction dictionary with predicted_class, confidence, probabilities
-        explanation_text: Plain text explanation generated for the patient
-        image_paths: Dictionary with keys 'original', 'confidence' for image filenames
-        output_path: Path where HTML file should be saved
-        
-    Returns:
-        output_path: Path to saved HTML file
+    Generate patient-friendly explanation based on prediction
     """
-    from src.model_utils import CLASS_NAMES
-    
-    # Extract patient data
-    patient_id = patient_info.get('id_code', patient_info.get('id', 'Unknown'))
-    patient_age = patient_info.get('age', 'N/A')
-    patient_gender = patient_info.get('gender', 'N/A')
-    true_diagnosis = patient_info.get('diagnosis', None)
-    
-    # Extract prediction data
     predicted_class = prediction['predicted_class']
     confidence = prediction['confidence']
-    probabilities = prediction['probabilities']
+    confidence_pct = int(confidence * 100)
     
-    # Build HTML
-    html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Eye Screening Report - Patient {patient_id}</title>
-    <style>
-        body {{
+    explanation = _patient_copy(predicted_class)[0].format(pct=confidence_pct)
+    
+    # Add low confidence warning if needed
+    if confidence < 0.7:
+        explanation += """
+        <p><strong>Note:</strong> Because the computer is less sure about this result, 
+        a nurse or doctor should review it carefully.</p>
+        """
+    
+    return explanation
+
+
+def get_next_steps(predicted_class, confidence):
+    """
+    Generate next steps recommendations based on prediction
+    """
+    return _patient_copy(predicted_class)[1]
+
+
+# Static stylesheet for generate_patient_report_html; only the result-box
+# colours vary, and there are just two variants, so both are built up front
+_REPORT_CSS = Template("""        body {
             font-family: Arial, sans-serif;
             max-width: 900px;
             margin: 40px auto;
             padding: 20px;
             line-height: 1.8;
             font-size: 14px;
-        }}
-        .header {{
+        }
+        .header {
             background-color: #2196F3;
             color: white;
             padding: 25px;
             text-align: center;
             border-radius: 8px;
             margin-bottom: 30px;
-        }}
-        .header h1 {{
+        }
+        .header h1 {
             margin: 0 0 10px 0;
             font-size: 28px;
-        }}
-        .patient-info {{
+        }
+        .patient-info {
             background-color: #f5f5f5;
             padding: 20px;
             border-radius: 8px;
             margin-bottom: 25px;
-        }}
-        .info-grid {{
+        }
+        .info-grid {
             display: grid;
             grid-template-columns: 150px 1fr;
             gap: 12px;
             margin: 10px 0;
-        }}
-        .info-label {{
+        }
+        .info-label {
             font-weight: bold;
             color: #555;
-        }}
-        .result-box {{
-            background-color: {"#e8f5e9" if predicted_class == 0 else "#fff3e0"};
-            border-left: 5px solid {"#4caf50" if predicted_class == 0 else "#ff9800"};
+        }
+        .result-box {
+            background-color: $bg;
+            border-left: 5px solid $bd;
             padding: 20px;
             margin: 25px 0;
             border-radius: 5px;
-        }}
-        .result-box h2 {{
+        }
+        .result-box h2 {
             margin: 0 0 10px 0;
-            color: {"#2e7d32" if predicted_class == 0 else "#e65100"};
-        }}
-        .diagnosis {{
+            color: $fg;
+        }
+        .diagnosis {
             font-size: 24px;
             font-weight: bold;
-            color: {"#2e7d32" if predicted_class == 0 else "#e65100"};
+            color: $fg;
             margin: 10px 0;
-        }}
-        .section {{
+        }
+        .section {
             margin: 30px 0;
-        }}
-        .section-title {{
+        }
+        .section-title {
             font-size: 20px;
             font-weight: bold;
             color: #1976d2;
             margin-bottom: 15px;
             padding-bottom: 8px;
             border-bottom: 3px solid #2196F3;
-        }}
-        .image-container {{
+        }
+        .image-container {
             text-align: center;
             margin: 25px 0;
-        }}
-        .image-container img {{
+        }
+        .image-container img {
             max-width: 100%;
             height: auto;
             border-radius: 8px;
             box-shadow: 0 3px 6px rgba(0,0,0,0.15);
-        }}
-        .image-caption {{
+        }
+        .image-title {
+            font-size: 18px;
+            font-weight: bold;
+            margin-bottom: 10px;
+        }
+        .image-legend {
+            display: inline-block;
+            background-color: rgba(245, 222, 179, 0.5);
+            border-radius: 6px;
+            padding: 8px 14px;
+            font-size: 13px;
+            margin-top: 10px;
+        }
+        .image-caption {
             color: #666;
             font-size: 13px;
             margin-top: 10px;
             font-style: italic;
-        }}
-        .explanation-box {{
+        }
+        .explanation-box {
             background-color: #fafafa;
             padding: 25px;
             border-radius: 10px;
@@ -585,175 +579,189 @@ def generate_patient_report_html(patient_info, prediction, explanation_text,
             margin: 20px 0;
             font-family: Georgia, serif;
             line-height: 1.8;
-        }}
-        .explanation-section {{
+        }
+        .explanation-section {
             margin: 20px 0;
-        }}
-        .section-header {{
+        }
+        .section-header {
             color: #1976d2;
             font-size: 18px;
             font-weight: bold;
             margin: 15px 0 10px 0;
             padding-bottom: 5px;
             border-bottom: 2px solid #e3f2fd;
-        }}
-        .explanation-paragraph {{
+        }
+        .explanation-paragraph {
             margin: 12px 0;
             line-height: 1.7;
             color: #333;
-        }}
-        .explanation-list {{
+        }
+        .explanation-list {
             margin: 15px 0;
             padding-left: 0;
             list-style: none;
-        }}
-        .explanation-list li {{
+        }
+        .explanation-list li {
             margin: 8px 0;
             padding: 8px 0;
             line-height: 1.6;
-        }}
-        .list-icon {{
+        }
+        .list-icon {
             font-weight: bold;
             margin-right: 8px;
             font-size: 16px;
-        }}
-        .positive-result {{
+        }
+        .positive-result {
             color: #2e7d32;
             font-weight: bold;
             background-color: #e8f5e9;
             padding: 10px;
             border-radius: 5px;
             margin: 10px 0;
-        }}
-        .warning-result {{
+        }
+        .warning-result {
             color: #d84315;
             font-weight: bold;
             background-color: #fff3e0;
             padding: 10px;
             border-radius: 5px;
             margin: 10px 0;
-        }}
-        .confidence-text {{
+        }
+        .confidence-text {
             background-color: #e3f2fd;
             padding: 10px;
             border-radius: 5px;
             margin: 10px 0;
             color: #1976d2;
-        }}
-        .important-note {{
+        }
+        .important-note {
             background-color: #fff8e1;
             border: 2px solid #ffc107;
             padding: 20px;
             border-radius: 8px;
             margin: 25px 0;
-        }}
-        .important-note strong {{
+        }
+        .important-note strong {
             color: #f57c00;
-        }}
-        ul {{
+        }
+        ul {
             line-height: 2;
             margin: 10px 0;
-        }}
-        .footer {{
+        }
+        .footer {
             text-align: center;
             margin-top: 40px;
             padding-top: 20px;
             border-top: 2px solid #ddd;
             color: #777;
             font-size: 12px;
-        }}
-    </style>
+        }
+""")
+
+# (background, border, text) colours for healthy vs. disease-detected results
+_RESULT_COLORS = {
+    True: ('#e8f5e9', '#4caf50', '#2e7d32'),
+    False: ('#fff3e0', '#ff9800', '#e65100'),
+}
+
+_REPORT_STYLES = {
+    healthy: _REPORT_CSS.substitute(bg=bg, bd=bd, fg=fg)
+    for healthy, (bg, bd, fg) in _RESULT_COLORS.items()
+}
+
+_REPORT_HEAD = Template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Eye Screening Report - Patient $patient_id</title>
+    <style>
+$css""")
+
+
+# Report body, split into the fixed chunks around its optional sections.
+# _compile_report stitches them into one Template per schema.
+_BODY_INTRO = """    </style>
 </head>
 <body>
     <div class="header">
         <h1>Diabetic Retinopathy Screening Report</h1>
         <p style="margin: 5px 0; font-size: 16px;">Computer-Assisted Eye Disease Detection</p>
-        <p style="margin: 5px 0;">Generated on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}</p>
+        <p style="margin: 5px 0;">Generated on $generated_on</p>
     </div>
     
     <div class="patient-info">
         <h3 style="margin-top: 0; color: #333;">PATIENT INFORMATION</h3>
         <div class="info-grid">
             <div class="info-label">Patient ID:</div>
-            <div>{patient_id}</div>
+            <div>$patient_id</div>
             <div class="info-label">Age:</div>
-            <div>{patient_age} years</div>
+            <div>$patient_age years</div>
             <div class="info-label">Gender:</div>
-            <div>{patient_gender}</div>
+            <div>$patient_gender</div>
             <div class="info-label">Screening Date:</div>
-            <div>{datetime.now().strftime('%B %d, %Y')}</div>
+            <div>$screening_date</div>
 """
-    
-    if true_diagnosis is not None:
-        html += f"""
+
+_BODY_TRUE_DIAGNOSIS = """
             <div class="info-label">True Diagnosis:</div>
-            <div>Class {true_diagnosis} ({CLASS_NAMES[true_diagnosis]})</div>
+            <div>Class $true_diagnosis ($true_label)</div>
 """
-    
-    html += """
+
+_BODY_RESULT = """
         </div>
     </div>
     
     <div class="result-box">
         <h2>SCREENING RESULT</h2>
-"""
-    
-    html += f"""
-        <div class="diagnosis">{CLASS_NAMES[predicted_class]}</div>
+
+        <div class="diagnosis">$predicted_label</div>
         <p style="font-size: 16px; margin: 10px 0;">
-            <strong>Confidence Level:</strong> {int(confidence * 100)}%<br>
-            <span style="color: #666;">The computer is {int(confidence * 100)}% confident about this result.</span>
+            <strong>Confidence Level:</strong> $confidence_pct%<br>
+            <span style="color: #666;">The computer is $confidence_pct% confident about this result.</span>
         </p>
 """
-    
-    if true_diagnosis is not None and predicted_class == true_diagnosis:
-        html += '<p style="color: green; font-weight: bold;">✓ Prediction matches actual diagnosis</p>'
-    elif true_diagnosis is not None:
-        html += '<p style="color: orange; font-weight: bold;">⚠ Prediction differs from actual diagnosis</p>'
-    
-    html += """
+
+_VERDICT_MATCH = '<p style="color: green; font-weight: bold;">✓ Prediction matches actual diagnosis</p>'
+_VERDICT_DIFFERS = '<p style="color: orange; font-weight: bold;">⚠ Prediction differs from actual diagnosis</p>'
+
+_BODY_VISUAL = """
     </div>
     
     <div class="section">
         <div class="section-title">VISUAL EXPLANATION</div>
 """
-    
-    if 'original' in image_paths:
-        html += f"""
+
+_BODY_ORIGINAL = """
         <div class="image-container">
-            <img src="{image_paths['original']}" alt="Eye Analysis">
+            <p class="image-title">What the Computer Saw in Your Eye Photo</p>
+            <img src="$original_src" alt="Eye Analysis">
+            <p class="image-legend">Red/yellow areas = where the computer looked most closely<br>Blue/green areas = normal areas</p>
             <p class="image-caption">Areas highlighted show where the computer focused its attention during analysis</p>
         </div>
 """
-    
-    html += """
+
+_BODY_BREAKDOWN = """
     </div>
     
     <div class="section">
         <div class="section-title">CONFIDENCE BREAKDOWN</div>
 """
-    
-    if 'confidence' in image_paths:
-        html += f"""
+
+_BODY_CONFIDENCE = """
         <div class="image-container">
-            <img src="{image_paths['confidence']}" alt="Confidence Chart">
+            <img src="$confidence_src" alt="Confidence Chart">
             <p class="image-caption">How confident the computer is for each disease level</p>
         </div>
 """
-    
-    html += """
+
+_BODY_OUTRO = """
     </div>
     
     <div class="section">
         <div class="section-title">DETAILED EXPLANATION</div>
         <div class="explanation-box">
-"""
-    
-    # Format the explanation text as HTML
-    formatted_explanation = format_explanation_text_to_html(explanation_text)
-    html += formatted_explanation
-    
-    html += """
+$explanation_html
         </div>
     </div>
     
@@ -775,13 +783,109 @@ def generate_patient_report_html(patient_info, prediction, explanation_text,
 </body>
 </html>
 """
+
+
+@lru_cache(maxsize=8)
+def _compile_report(has_true_diagnosis, has_original, has_confidence):
+    """
+    Build the report body Template for one combination of optional sections
+    
+    Reports in a batch share the same schema, so the section branches are
+    resolved once here rather than on every report.
+    """
+    chunks = [_BODY_INTRO]
+    if has_true_diagnosis:
+        chunks.append(_BODY_TRUE_DIAGNOSIS)
+    chunks.append(_BODY_RESULT)
+    if has_true_diagnosis:
+        chunks.append('$verdict')
+    chunks.append(_BODY_VISUAL)
+    if has_original:
+        chunks.append(_BODY_ORIGINAL)
+    chunks.append(_BODY_BREAKDOWN)
+    if has_confidence:
+        chunks.append(_BODY_CONFIDENCE)
+    chunks.append(_BODY_OUTRO)
+    return Template("".join(chunks))
+
+
+def generate_patient_report_html(patient_info, prediction, explanation_text, 
+                                  image_paths, output_path=None):
+    """
+    Generate HTML report for a patient with SHAP explanations
+    
+    Args:
+        patient_info: Pandas Series or dict with patient information (id_code, age, gender, diagnosis)
+        prediction: Prediction dictionary with predicted_class, confidence, probabilities
+        explanation_text: Plain text explanation generated for the patient
+        image_paths: Dictionary with keys 'original', 'confidence' for image filenames
+        output_path: Path where HTML file should be saved (optional; without
+            it nothing is written, e.g. when rendering straight to PDF)
+        
+    Returns:
+        html: Generated HTML string
+    """
+    from src.model_utils import CLASS_NAMES
+    
+    # Extract patient data
+    patient_id = patient_info.get('id_code', patient_info.get('id', 'Unknown'))
+    patient_age = patient_info.get('age', 'N/A')
+    patient_gender = patient_info.get('gender', 'N/A')
+    true_diagnosis = patient_info.get('diagnosis', None)
+    
+    # Extract prediction data
+    predicted_class = prediction['predicted_class']
+    confidence = prediction['confidence']
+    probabilities = prediction['probabilities']
+    
+    # One clock read for both timestamps
+    now = datetime.now()
+    generated_on = now.strftime('%B %d, %Y at %I:%M %p')
+    screening_date = now.strftime('%B %d, %Y')
+    
+    # Build HTML from the template specialized for this report's optional sections
+    body = _compile_report(true_diagnosis is not None,
+                           'original' in image_paths,
+                           'confidence' in image_paths)
+    html = _REPORT_HEAD.substitute(patient_id=patient_id, css=_REPORT_STYLES[predicted_class == 0]) \
+        + body.substitute(
+            generated_on=generated_on,
+            patient_id=patient_id,
+            patient_age=patient_age,
+            patient_gender=patient_gender,
+            screening_date=screening_date,
+            true_diagnosis=true_diagnosis,
+            true_label=CLASS_NAMES[true_diagnosis] if true_diagnosis is not None else '',
+            verdict=(_VERDICT_MATCH if predicted_class == true_diagnosis else _VERDICT_DIFFERS),
+            predicted_label=CLASS_NAMES[predicted_class],
+            confidence_pct=int(confidence * 100),
+            original_src=image_paths.get('original', ''),
+            confidence_src=image_paths.get('confidence', ''),
+            # Format the explanation text as HTML
+            explanation_html=format_explanation_text_to_html(explanation_text)
+        )
+    
+    # Save HTML file if requested
+    if output_path:
+        _ensure_dir(os.path.dirname(output_path))
+        with open(output_path, 'wb') as f:
+            f.write(html.encode('utf-8'))
     
-    # Save HTML file
-    os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+    return html
+
+
+def render_pdf(html_string, pdf_path, base_url=None):
+    """
+    Render an HTML string straight to PDF with WeasyPrint, without a temp file
     
-    return output_path
+    Args:
+        html_string: HTML document, e.g. from generate_patient_report_html
+        pdf_path: Path for output PDF
+        base_url: Directory relative image paths are resolved against
+    """
+    from weasyprint import HTML
+    HTML(string=html_string, base_url=base_url).write_pdf(pdf_path)
+    print(f"Successfully created PDF: {pdf_path}")
 
 
 def html_to_pdf(html_path, pdf_path):
@@ -809,6 +913,41 @@ def html_to_pdf(html_path, pdf_path):
             print("You can manually print to PDF from your browser.")
 
 
+def html_to_pdf_batch(html_paths, pdf_paths):
+    """
+    Convert several HTML files to PDF, initializing the engine only once
+    
+    WeasyPrint is preferred here because one FontConfiguration can be shared
+    across all documents; pdfkit would start a wkhtmltopdf process per file.
+    
+    Args:
+        html_paths: List of HTML file paths
+        pdf_paths: Output PDF path for each HTML file
+    """
+    try:
+        from weasyprint import HTML
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:
+        HTML = None
+    
+    if HTML is not None:
+        font_config = FontConfiguration()
+        for html_path, pdf_path in zip(html_paths, pdf_paths):
+            HTML(html_path).write_pdf(pdf_path, font_config=font_config)
+            print(f"Successfully created PDF: {pdf_path}")
+        return
+    
+    try:
+        import pdfkit
+        for html_path, pdf_path in zip(html_paths, pdf_paths):
+            pdfkit.from_file(html_path, pdf_path)
+            print(f"Successfully created PDF: {pdf_path}")
+    except ImportError:
+        print("Neither pdfkit nor weasyprint installed.")
+        print("Install with: pip install pdfkit weasyprint")
+        print("You can manually print the HTML files to PDF from your browser.")
+
+
 def concatenate_pdfs(pdf_paths, output_path):
     """
     Concatenate multiple PDFs into one
@@ -817,16 +956,40 @@ def concatenate_pdfs(pdf_paths, output_path):
         pdf_paths: List of PDF file paths to concatenate
         output_path: Path for combined PDF
     """
+    existing = [pdf for pdf in pdf_paths if os.path.exists(pdf)]
+    
+    try:
+        import pikepdf
+    except ImportError:
+        pikepdf = None
+    
+    if pikepdf is not None:
+        # libqpdf copies page objects in C++; sources are parsed in parallel
+        # (it releases the GIL) and must stay open until the output is saved
+        with ThreadPoolExecutor() as executor:
+            futures = [executor.submit(pikepdf.Pdf.open, pdf) for pdf in existing]
+        try:
+            with pikepdf.Pdf.new() as out:
+                for future in futures:
+                    out.pages.extend(future.result().pages)
+                out.save(output_path)
+        finally:
+            # Close every source that opened, even if another one failed
+            for future in futures:
+                if future.exception() is None:
+                    future.result().close()
+        print(f"Successfully created combined PDF: {output_path}")
+        return
+    
     try:
         from PyPDF2 import PdfMerger
         
         merger = PdfMerger()
-        for pdf in pdf_paths:
-            if os.path.exists(pdf):
-                merger.append(pdf)
+        for pdf in existing:
+            merger.append(pdf)
         
         merger.write(output_path)
         merger.close()
         print(f"Successfully created combined PDF: {output_path}")
     except ImportError:
-        print("PyPDF2 not installed. Install with: pip install PyPDF2")
+        print("Neither pikepdf nor PyPDF2 installed. Install with: pip install pikepdf")
@@ -3,58 +3,764 @@ Model utilities for loading model and making predictions
 """
 
 import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.models import load_model
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 
 # Diagnosis class names
 CLASS_NAMES = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
+CLASS_NAMES_ARR = np.array(CLASS_NAMES)
+
+# Confidence levels and the lower bound of each level above 'Low'
+_CONFIDENCE_LEVELS = np.array(['Low', 'Medium', 'High', 'Very High'])
+_CONFIDENCE_CUTS = np.array([0.6, 0.75, 0.9])
+
+# Referral guidance per predicted class
+_RECOMMENDATIONS = {
+    0: {  # No DR
+        'nurse': 'Result indicates no diabetic retinopathy. Routine follow-up recommended.',
+        'patient': 'Your eyes look healthy. Come back for another screening in 1 year.',
+        'urgency': 'routine'
+    },
+    1: {  # Mild
+        'nurse': 'Mild diabetic retinopathy detected. Recommend follow-up in 6-12 months.',
+        'patient': 'Early signs detected. See an eye doctor within 6-12 months to monitor your eyes.',
+        'urgency': 'monitor'
+    },
+    2: {  # Moderate
+        'nurse': 'Moderate diabetic retinopathy. Refer to eye specialist within 3-6 months.',
+        'patient': 'Your eyes need attention. See an eye doctor within 3-6 months for treatment.',
+        'urgency': 'refer'
+    },
+    3: {  # Severe
+        'nurse': 'Severe diabetic retinopathy. Urgent referral to eye specialist within 1-2 months.',
+        'patient': 'Your eyes need urgent care. See an eye doctor within 1-2 months. Treatment can protect your vision.',
+        'urgency': 'urgent'
+    },
+    4: {  # Proliferative DR
+        'nurse': 'Proliferative diabetic retinopathy. Immediate referral to eye specialist (within 2 weeks).',
+        'patient': 'Your eyes need immediate attention. See an eye doctor within 2 weeks. Early treatment is very important.',
+        'urgency': 'immediate'
+    }
+}
+
+# Plain-language explanations, split around the confidence percentage
+_EXPLANATIONS = {
+    0: ("Good news! The screening tool did not find signs of eye disease. The computer is ", "% sure about this result."),
+    1: ("The screening found early signs of eye disease. The computer is ", "% sure. This means your eyes need to be checked again soon."),
+    2: ("The screening found signs of eye disease that need attention. The computer is ", "% sure. An eye doctor should examine your eyes within a few months."),
+    3: ("The screening found serious signs of eye disease. The computer is ", "% sure. You need to see an eye doctor soon for treatment."),
+    4: ("The screening found advanced eye disease. The computer is ", "% sure. It's very important to see an eye doctor right away for treatment.")
+}
+
+_GPUS = tf.config.list_physical_devices('GPU')
+
+# Rows preallocated in each thread's input staging buffer
+_MAX_BATCH = 32
+_HOST_BUFS = threading.local()
 
+# Loaded, warmed-up models keyed by load_trained_model arguments
+_MODEL_CACHE = {}
+_MODEL_CACHE_LOCK = threading.Lock()
 
-def load_trained_model(model_path='model/model.h5'):
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _top1(outputs):
+        """Per-row argmax and max of a (batch, n_classes) array in one pass"""
+        B, C = outputs.shape
+        classes = np.empty(B, dtype=np.int64)
+        top = np.empty(B, dtype=outputs.dtype)
+        for i in numba.prange(B):
+            best = 0
+            for j in range(1, C):
+                if outputs[i, j] > outputs[i, best]:
+                    best = j
+            classes[i] = best
+            top[i] = outputs[i, best]
+        return classes, top
+else:
+    def _top1(outputs):
+        """NumPy fallback for the per-row argmax and max"""
+        classes = outputs.argmax(axis=1)
+        return classes, outputs[np.arange(len(classes)), classes]
+
+
+def load_trained_model(model_path='model/model.h5', use_tensorrt=False, precision='FP16',
+                       mixed_precision=False):
     """
     Load the pre-trained diabetic retinopathy model
     
     Args:
-        model_path: Path to the saved model file
+        model_path: Path to the saved model file (.h5, .tflite or .onnx), or a
+            SavedModel directory from export_saved_model
+        use_tensorrt: Convert the model to a TensorRT-optimized SavedModel (NVIDIA
+            GPUs only). The converted model is cached next to model_path and only
+            supports prediction, not Grad-CAM.
+        precision: TensorRT precision mode ('FP32' or 'FP16'); INT8 needs
+            calibration data and is not supported here
+        mixed_precision: Rebuild the model under the 'mixed_float16' policy
+            (see _to_mixed_precision) so the network computes in float16
+            (tensor-core GPUs); inputs are fed as float16 and probabilities
+            are returned as float32
         
     Returns:
-        model: Loaded Keras model
+        model: Loaded Keras model, a serving signature for SavedModel
+            directories or if use_tensorrt, or a TFLitePredictor/OnnxPredictor
+            for .tflite/.onnx files. These only support prediction. Repeated calls with the same
+            arguments return the cached instance.
     """
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found: {model_path}")
+    if use_tensorrt and precision not in ('FP32', 'FP16'):
+        raise ValueError(f"Unsupported TensorRT precision: {precision!r} (use 'FP32' or 'FP16')")
+    
+    key = (os.path.abspath(model_path), use_tensorrt, precision, mixed_precision)
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is None:
+            model = _load_uncached(model_path, use_tensorrt, precision, mixed_precision)
+            _MODEL_CACHE[key] = model
+    return model
+
+
+def _load_uncached(model_path, use_tensorrt, precision, mixed_precision):
+    """
+    Load a model for load_trained_model and run one warm-up prediction
+    
+    The warm-up pays graph tracing, XLA compilation and cuDNN autotuning here
+    instead of on the first real request.
+    """
+    if model_path.endswith('.tflite'):
+        print(f"Loading TFLite model from {model_path}...")
+        predictor = TFLitePredictor(model_path)
+        _run_model(predictor, np.zeros((1,) + predictor.input_shape[1:], np.float32))
+        return predictor
+    
+    if model_path.endswith('.onnx'):
+        print(f"Loading ONNX model from {model_path}...")
+        predictor = OnnxPredictor(model_path)
+        _run_model(predictor, np.zeros((1,) + predictor.input_shape[1:], np.float32))
+        return predictor
+    
+    if os.path.isdir(model_path) and not use_tensorrt:
+        print(f"Loading SavedModel from {model_path}...")
+        signature = _load_signature(model_path)
+        spec = next(iter(signature.structured_input_signature[1].values()))
+        if spec.shape[1:].is_fully_defined():
+            _run_model(signature, np.zeros([1] + spec.shape[1:].as_list(), np.float32))
+        return signature
     
     print(f"Loading model from {model_path}...")
     model = load_model(model_path)
     print("Model loaded successfully!")
     
+    if mixed_precision:
+        model = _to_mixed_precision(model)
+    
+    warmup = np.zeros((1,) + tuple(model.input_shape[1:]), np.float32)
+    
+    if use_tensorrt:
+        signature = _load_tensorrt(model, model_path, precision)
+        _run_model(signature, warmup)
+        return signature
+    
+    _attach_infer(model)
+    _run_model(model, warmup)
+    _run_model(model, np.repeat(warmup, _MAX_BATCH, axis=0))
+    
     return model
 
 
+def _to_mixed_precision(model):
+    """
+    Rebuild an FP32 Keras model under the 'mixed_float16' policy
+    
+    Layer configs saved in an .h5 file pin dtype='float32', so loading under
+    the policy alone keeps every layer in float32. The model is rebuilt from
+    its config with those dtypes dropped (inputs become float16 and the output
+    layer stays float32 for a stable softmax) and the weights are copied over.
+    The previous global policy is restored afterwards.
+    
+    Args:
+        model: Loaded Keras model
+        
+    Returns:
+        model: Float16-compute copy of the model
+    """
+    config = model.get_config()
+    output_names = {name for name, *_ in config.get('output_layers', ())}
+    _drop_dtypes(config, keep=output_names)
+    
+    previous = keras.mixed_precision.global_policy()
+    keras.mixed_precision.set_global_policy('mixed_float16')
+    try:
+        mixed = model.__class__.from_config(config)
+    finally:
+        keras.mixed_precision.set_global_policy(previous)
+    mixed.set_weights(model.get_weights())
+    
+    conv = next((layer for layer in mixed.submodules
+                 if isinstance(layer, keras.layers.Conv2D)), None)
+    if conv is None or conv.compute_dtype != 'float16':
+        raise RuntimeError("Mixed precision rebuild did not produce float16 conv layers")
+    return mixed
+
+
+def _drop_dtypes(config, keep=()):
+    """Strip pinned layer dtypes from a (possibly nested) model config in place"""
+    for layer in config.get('layers', ()):
+        layer_config = layer['config']
+        if layer['class_name'] == 'InputLayer':
+            layer_config['dtype'] = 'float16'
+        elif layer_config.get('name') not in keep:
+            layer_config.pop('dtype', None)
+        _drop_dtypes(layer_config)
+
+
+def _attach_infer(model):
+    """
+    Attach traced, XLA-compiled inference functions as model._infer1/_inferN
+    
+    Calling the concrete functions skips model.predict's per-call Keras
+    machinery (data adapters, callbacks, retracing checks). _infer1 takes one
+    image and _inferN a full batch of _MAX_BATCH, so XLA and cuDNN specialize
+    for static shapes. Float16 models take float16 inputs, halving
+    host-to-device traffic. Both return (probabilities, predicted classes,
+    confidences), reducing on device.
+    """
+    height, width = model.input_shape[1:3]
+    dtype = tf.float16 if model.compute_dtype == 'float16' else tf.float32
+    
+    # With a separate Softmax output layer, run the body up to the logits and
+    # apply softmax in float32, so float16 models can't underflow in it
+    head = model
+    if isinstance(model.layers[-1], keras.layers.Softmax):
+        head = keras.Model(model.inputs, model.layers[-1].input)
+    
+    def infer(x):
+        probabilities = tf.cast(head(x, training=False), tf.float32)
+        if head is not model:
+            probabilities = tf.nn.softmax(probabilities)
+        return (probabilities,
+                tf.argmax(probabilities, axis=1, output_type=tf.int32),
+                tf.reduce_max(probabilities, axis=1))
+    
+    traced = tf.function(infer, jit_compile=True)
+    model._input_dtype = dtype.as_numpy_dtype
+    model._infer1 = traced.get_concrete_function(tf.TensorSpec([1, height, width, 3], dtype))
+    model._inferN = traced.get_concrete_function(tf.TensorSpec([_MAX_BATCH, height, width, 3], dtype))
+
+
+def _load_tensorrt(model, model_path, precision):
+    """
+    Convert a Keras model to TensorRT once and load the cached engine
+    
+    The conversion runs in a temporary directory next to the cache and is
+    renamed into place at the end, so an interrupted run leaves no partial
+    cache behind.
+    
+    Returns:
+        signature: 'serving_default' concrete function of the TRT SavedModel
+    """
+    trt_dir = f"{os.path.splitext(model_path)[0]}_trt_{precision.lower()}"
+    
+    if not os.path.isdir(trt_dir):
+        print(f"Converting model to TensorRT ({precision})...")
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(trt_dir) or '.') as tmp_dir:
+            saved_model_dir = os.path.join(tmp_dir, 'src')
+            model.save(saved_model_dir, save_format='tf')
+            
+            trt = tf.experimental.tensorrt
+            converter = trt.Converter(
+                input_saved_model_dir=saved_model_dir,
+                conversion_params=trt.ConversionParams(precision_mode=precision,
+                                                       maximum_cached_engines=1)
+            )
+            converter.convert()
+            
+            # Build the engine ahead of time for the model's input size
+            height, width = model.input_shape[1:3]
+            converter.build(input_fn=lambda: [tf.zeros((1, height, width, 3), tf.float32)])
+            converter.save(os.path.join(tmp_dir, 'trt'))
+            os.rename(os.path.join(tmp_dir, 'trt'), trt_dir)
+        print(f"TensorRT model saved to {trt_dir}")
+    
+    return _load_signature(trt_dir)
+
+
+def _load_signature(saved_model_dir):
+    """
+    Load the 'serving_default' signature of a SavedModel
+    
+    The signature only weakly references the variables it captures, so the
+    loaded object is kept alive on it.
+    """
+    loaded = tf.saved_model.load(saved_model_dir)
+    signature = loaded.signatures['serving_default']
+    signature._saved_model = loaded
+    return signature
+
+
+def export_saved_model(model_path='model/model.h5', out_dir='model/model_sm'):
+    """
+    One-time migration of an HDF5 Keras model to the SavedModel format
+    
+    Args:
+        model_path: Path to the .h5 model
+        out_dir: Directory to write; pass it to load_trained_model afterwards
+        
+    Returns:
+        out_dir: Path to the SavedModel directory
+    """
+    model = load_model(model_path)
+    height, width = model.input_shape[1:3]
+    
+    # Trace the serving signature with a batch-polymorphic input
+    serve = tf.function(lambda images: {'probabilities': model(images, training=False)})
+    tf.saved_model.save(model, out_dir, signatures=serve.get_concrete_function(
+        tf.TensorSpec([None, height, width, 3], tf.float32, name='images')))
+    print(f"Saved SavedModel to {out_dir}")
+    
+    return out_dir
+
+
+class TFLitePredictor:
+    """
+    Run a (typically INT8-quantized) TFLite model with the predict_* API
+    
+    Quantized inputs/outputs are converted using the tensors' own scale and
+    zero point, so callers keep passing 0-1 float images and get probabilities.
+    """
+    
+    def __init__(self, model_path, num_threads=None, num_interpreters=1):
+        """
+        Args:
+            model_path: Path to the .tflite file
+            num_threads: Threads per interpreter (default: all cores for a
+                single interpreter, 1 each for a pool)
+            num_interpreters: Interpreters to run batch images on in parallel;
+                invoke() releases the GIL, so a pool scales across CPU cores
+        """
+        if num_threads is None:
+            num_threads = os.cpu_count() if num_interpreters == 1 else 1
+        
+        # Idle interpreters; each call checks one out, so callers never share one
+        self._pool = queue.Queue()
+        for _ in range(num_interpreters):
+            interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+            interpreter.allocate_tensors()
+            self._pool.put(interpreter)
+        self._executor = (ThreadPoolExecutor(max_workers=num_interpreters)
+                          if num_interpreters > 1 else None)
+        
+        self.interpreter = interpreter
+        self._input = interpreter.get_input_details()[0]
+        self._output = interpreter.get_output_details()[0]
+        self.input_shape = tuple(self._input['shape'])
+    
+    def _invoke(self, image):
+        """Run one image and return the raw (possibly quantized) output row"""
+        in_dtype = self._input['dtype']
+        x = image[np.newaxis]
+        if np.issubdtype(in_dtype, np.integer):
+            in_scale, in_zero = self._input['quantization']
+            info = np.iinfo(in_dtype)
+            x = np.clip(np.round(x / in_scale + in_zero), info.min, info.max)
+        
+        interpreter = self._pool.get()
+        try:
+            interpreter.set_tensor(self._input['index'], x.astype(in_dtype))
+            interpreter.invoke()
+            return interpreter.get_tensor(self._output['index'])[0].copy()
+        finally:
+            self._pool.put(interpreter)
+    
+    def predict(self, images):
+        """
+        Predict class probabilities for a batch, one interpreter call per image
+        
+        Args:
+            images: Batch of preprocessed images (batch_size, height, width, 3)
+            
+        Returns:
+            probabilities: Numpy array of shape (batch_size, n_classes)
+        """
+        return self._dequantize(self._invoke_batch(images))
+    
+    def predict_top(self, images):
+        """
+        Like predict, but also return each image's top class and its score
+        
+        The argmax runs on the raw (e.g. uint8) outputs, since dequantization
+        preserves order, and only the winning scores are dequantized for it.
+        
+        Returns:
+            probabilities, classes, confidences: Numpy arrays of shape
+                (batch_size, n_classes), (batch_size,) and (batch_size,)
+        """
+        outputs = self._invoke_batch(images)
+        classes, top = _top1(outputs)
+        return self._dequantize(outputs), classes, self._dequantize(top)
+    
+    def _invoke_batch(self, images):
+        if self._executor is not None and len(images) > 1:
+            return np.stack(list(self._executor.map(self._invoke, images)))
+        return np.stack([self._invoke(image) for image in images])
+    
+    def _dequantize(self, outputs):
+        if np.issubdtype(outputs.dtype, np.integer):
+            out_scale, out_zero = self._output['quantization']
+            return (outputs.astype(np.float32) - out_zero) * out_scale
+        return outputs
+
+
+class OnnxPredictor:
+    """
+    Run an ONNX export of the model with ONNX Runtime
+    
+    Uses the CUDA execution provider when onnxruntime-gpu is installed and
+    falls back to the CPU provider otherwise.
+    """
+    
+    def __init__(self, model_path):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime not installed. Install with: pip install onnxruntime") from None
+        
+        available = ort.get_available_providers()
+        providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+        self.session = ort.InferenceSession(model_path, providers=providers)
+        self._input_name = self.session.get_inputs()[0].name
+        
+        # Export with a dynamic batch axis, so only the image dims are static
+        self.input_shape = (None,) + tuple(self.session.get_inputs()[0].shape[1:])
+    
+    def predict(self, images):
+        """
+        Predict class probabilities for a batch in one session run
+        
+        Args:
+            images: Batch of preprocessed images (batch_size, height, width, 3)
+            
+        Returns:
+            probabilities: Numpy array of shape (batch_size, n_classes)
+        """
+        return self.session.run(None, {self._input_name: _host_buffer(images)})[0]
+
+
+def export_to_onnx(model, out_path, opset=17):
+    """
+    Export a Keras model to ONNX for OnnxPredictor
+    
+    Args:
+        model: Trained Keras model
+        out_path: Where to write the .onnx file
+        opset: ONNX opset version
+        
+    Returns:
+        out_path: Path to the exported model
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("tf2onnx not installed. Install with: pip install tf2onnx") from None
+    
+    height, width = model.input_shape[1:3]
+    spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name='images'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=out_path)
+    print(f"Saved ONNX model to {out_path}")
+    
+    return out_path
+
+
+def convert_to_tflite_int8(keras_model, rep_dataset, out_path):
+    """
+    Post-training INT8 quantization of a Keras model to TFLite
+    
+    Inputs and outputs are uint8, so TFLitePredictor can take the argmax on
+    the quantized outputs without dequantizing every score.
+    
+    Args:
+        keras_model: Trained Keras model
+        rep_dataset: Callable yielding [float32 batch of shape (1, H, W, 3)]
+            calibration samples
+        out_path: Where to write the .tflite file
+        
+    Returns:
+        out_path: Path to the saved model
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = rep_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+    tflite_model = converter.convert()
+    
+    # TFLitePredictor.predict_top takes its argmax on the raw uint8 outputs
+    output_dtype = tf.lite.Interpreter(model_content=tflite_model).get_output_details()[0]['dtype']
+    if output_dtype != np.uint8:
+        raise RuntimeError(f"Expected a uint8 TFLite output, got {np.dtype(output_dtype).name}")
+    
+    with open(out_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Saved INT8 TFLite model to {out_path}")
+    
+    return out_path
+
+
+class BatchedPredictor:
+    """
+    Coalesce concurrent single-image predictions into batched forward passes
+    
+    Wrap a loaded model and pass the wrapper to predict_single from several
+    threads (e.g. a web server's request handlers). A background worker
+    collects up to max_batch images, waiting at most max_wait_ms after the
+    first one, and runs them through the model in one call.
+    """
+    
+    def __init__(self, model, max_batch=32, max_wait_ms=10):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        # Guards _closed so no image can be queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+    
+    def submit(self, image):
+        """
+        Queue one image (height, width, 3) for prediction
+        
+        Returns:
+            future: Resolves to that image's probability vector
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchedPredictor is closed")
+            self._queue.put((image, future))
+        return future
+    
+    def close(self):
+        """Stop the worker thread after the queued images are processed"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._worker.join()
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            # Gather more requests until the batch is full or the wait runs out
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                probabilities = _run_model(self.model, np.stack([image for image, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), probs in zip(batch, probabilities):
+                future.set_result(probs)
+
+
+def _host_buffer(images, dtype=np.float32, rows=None):
+    """
+    Copy a batch into this thread's reusable staging buffer
+    
+    The buffer is only reallocated when the image size or dtype changes or a
+    batch is larger than any seen before, so steady-state calls allocate nothing.
+    With rows, the returned view is padded to that many rows; the padding
+    holds stale data whose outputs the caller discards.
+    """
+    n, shape = len(images), images.shape[1:]
+    rows = rows or n
+    buf = getattr(_HOST_BUFS, 'buf', None)
+    if buf is None or buf.shape[1:] != shape or buf.dtype != dtype or len(buf) < rows:
+        buf = np.empty((max(rows, _MAX_BATCH),) + shape, dtype)
+        _HOST_BUFS.buf = buf
+    np.copyto(buf[:n], images)
+    return buf[:rows]
+
+
+def _run_model(model, images):
+    """
+    Run a forward pass on a batch and return class probabilities
+    
+    Args:
+        model: Keras model, serving signature, TFLitePredictor or OnnxPredictor
+            from load_trained_model
+        images: Batch of preprocessed images (batch_size, height, width, 3)
+        
+    Returns:
+        probabilities: Numpy array of shape (batch_size, n_classes)
+    """
+    if isinstance(model, (TFLitePredictor, OnnxPredictor)):
+        return model.predict(images)
+    
+    if isinstance(model, BatchedPredictor):
+        # Whole batches need no coalescing; run them on the wrapped model
+        return _run_model(model.model, images)
+    
+    if getattr(model, '_infer1', None) is not None:
+        return _run_model_top(model, images)[0]
+    
+    if isinstance(model, keras.Model):
+        # Models not loaded through load_trained_model: call the model directly,
+        # leaving predict's batch splitting for arrays too big for one pass
+        if len(images) > _MAX_BATCH:
+            return model.predict(images, verbose=0)
+        return np.asarray(model(_host_buffer(images), training=False), dtype=np.float32)
+    
+    # Serving signatures take keyword inputs and return a dict of outputs
+    input_name = next(iter(model.structured_input_signature[1]))
+    outputs = model(**{input_name: tf.constant(_host_buffer(images))})
+    return next(iter(outputs.values())).numpy()
+
+
+def _run_model_top(model, images):
+    """
+    Run a forward pass and also return each image's top class and its score
+    
+    Returns:
+        probabilities, classes, confidences: Numpy arrays of shape
+            (batch_size, n_classes), (batch_size,) and (batch_size,)
+    """
+    if isinstance(model, TFLitePredictor):
+        return model.predict_top(images)
+    
+    if getattr(model, '_infer1', None) is not None:
+        return _run_static(model, images)
+    
+    probabilities = _run_model(model, images)
+    return (probabilities,) + _top1(np.ascontiguousarray(probabilities))
+
+
+def _run_static(model, images):
+    """
+    Run the fixed-shape functions from _attach_infer on any number of images
+    
+    Batches go through _inferN in chunks of _MAX_BATCH, padding the last one.
+    Multi-chunk batches stream through a prefetching tf.data pipeline so the
+    next chunk's host-to-device copy overlaps the current forward pass.
+    """
+    if len(images) == 1:
+        outputs = model._infer1(tf.constant(_host_buffer(images, model._input_dtype)))
+        return tuple(output.numpy() for output in outputs)
+    
+    if len(images) <= _MAX_BATCH:
+        outputs = model._inferN(tf.constant(_host_buffer(images, model._input_dtype, _MAX_BATCH)))
+        return tuple(output.numpy()[:len(images)] for output in outputs)
+    
+    chunks = [[output.numpy() for output in model._inferN(batch)]
+              for batch in _prefetched_batches(images, model._input_dtype)]
+    return tuple(np.concatenate(parts)[:len(images)] for parts in zip(*chunks))
+
+
+def _prefetched_batches(images, dtype):
+    """Zero-padded _MAX_BATCH chunks of images, prefetched onto the GPU if present"""
+    def pad(batch):
+        batch = tf.cast(batch, dtype)
+        return tf.pad(batch, [[0, _MAX_BATCH - tf.shape(batch)[0]], [0, 0], [0, 0], [0, 0]])
+    
+    dataset = tf.data.Dataset.from_tensor_slices(images).batch(_MAX_BATCH).map(pad)
+    if _GPUS:
+        return dataset.apply(tf.data.experimental.prefetch_to_device('/GPU:0'))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+@dataclass(slots=True)
+class Prediction:
+    """
+    Compact prediction record returned by predict_batch
+    
+    Supports prediction['key'] lookups so code written against the old
+    dictionaries keeps working.
+    """
+    predicted_class: int
+    predicted_label: str
+    confidence: float
+    probabilities: np.ndarray
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def as_dict(self):
+        """Return the prediction as a plain dictionary (sharing the probabilities row)"""
+        return {
+            'predicted_class': self.predicted_class,
+            'predicted_label': self.predicted_label,
+            'confidence': self.confidence,
+            'probabilities': self.probabilities
+        }
+
+
 def predict_single(model, image):
     """
     Make prediction for a single image
     
     Args:
-        model: Trained Keras model
+        model: Trained Keras model (or a BatchedPredictor wrapping one)
         image: Preprocessed image (normalized, shape: (height, width, 3))
         
     Returns:
         prediction: Dictionary with prediction results
     """
-    # Add batch dimension if needed
-    if len(image.shape) == 3:
-        image = np.expand_dims(image, axis=0)
+    # Add batch dimension if needed (a view, not a copy)
+    if image.ndim == 3:
+        image = image[np.newaxis]
     
-    # Get predictions
-    probabilities = model.predict(image, verbose=0)[0]
-    predicted_class = np.argmax(probabilities)
-    confidence = probabilities[predicted_class]
+    # Get predictions (a BatchedPredictor coalesces concurrent callers)
+    if isinstance(model, BatchedPredictor):
+        probabilities = model.submit(image[0]).result()
+        predicted_class = int(np.argmax(probabilities))
+        confidence = probabilities[predicted_class]
+    else:
+        probabilities, classes, confidences = _run_model_top(model, image)
+        probabilities, predicted_class, confidence = probabilities[0], int(classes[0]), confidences[0]
     
     prediction = {
-        'predicted_class': int(predicted_class),
+        'predicted_class': predicted_class,
         'predicted_label': CLASS_NAMES[predicted_class],
         'confidence': float(confidence),
         'probabilities': probabilities  # Return as numpy array for compatibility with visualization functions
@@ -72,27 +778,48 @@ def predict_batch(model, images):
         images: Batch of preprocessed images (shape: (batch_size, height, width, 3))
         
     Returns:
-        predictions: List of prediction dictionaries
+        predictions: List of Prediction records; probabilities is each image's
+            row of the batch output (use prediction_to_json for a class-name
+            mapping)
     """
-    # Get predictions
-    probabilities = model.predict(images, verbose=0)
+    # Get predictions, with top classes reduced on device when possible
+    probabilities, classes, confidences = _run_model_top(model, images)
     
-    predictions = []
-    for i in range(len(images)):
-        predicted_class = np.argmax(probabilities[i])
-        confidence = probabilities[i][predicted_class]
-        
-        prediction = {
-            'predicted_class': int(predicted_class),
-            'predicted_label': CLASS_NAMES[predicted_class],
-            'confidence': float(confidence),
-            'probabilities': {CLASS_NAMES[j]: float(probabilities[i][j]) for j in range(len(CLASS_NAMES))}
-        }
-        predictions.append(prediction)
+    # Convert to Python scalars in bulk
+    labels = np.take(CLASS_NAMES_ARR, classes)
+    
+    predictions = [
+        Prediction(predicted_class, label, confidence, row)
+        for predicted_class, label, confidence, row in zip(
+            classes.tolist(), labels.tolist(), confidences.tolist(), probabilities
+        )
+    ]
     
     return predictions
 
 
+def prediction_to_json(prediction):
+    """
+    Make a prediction JSON-serializable
+    
+    Args:
+        prediction: Prediction dictionary from predict_single() or Prediction
+            from predict_batch()
+        
+    Returns:
+        prediction: Dictionary with Python scalars and probabilities keyed by
+            class name
+    """
+    if isinstance(prediction, Prediction):
+        prediction = prediction.as_dict()
+    return {
+        **prediction,
+        'predicted_class': int(prediction['predicted_class']),
+        'confidence': float(prediction['confidence']),
+        'probabilities': dict(zip(CLASS_NAMES, map(float, prediction['probabilities'])))
+    }
+
+
 def get_confidence_level(confidence):
     """
     Convert confidence score to human-readable level
@@ -113,6 +840,19 @@ def get_confidence_level(confidence):
         return "Low"
 
 
+def get_confidence_levels(confidences):
+    """
+    Vectorized get_confidence_level for an array of confidence scores
+    
+    Args:
+        confidences: Array-like of confidence scores (0-1)
+        
+    Returns:
+        levels: Numpy array of level strings, same shape as confidences
+    """
+    return _CONFIDENCE_LEVELS[np.searchsorted(_CONFIDENCE_CUTS, np.asarray(confidences), side='right')]
+
+
 def get_recommendation(predicted_class, confidence):
     """
     Get recommendation based on prediction and confidence
@@ -124,35 +864,8 @@ def get_recommendation(predicted_class, confidence):
     Returns:
         recommendation: Dictionary with recommendations for nurses and patients
     """
-    recommendations = {
-        0: {  # No DR
-            'nurse': 'Result indicates no diabetic retinopathy. Routine follow-up recommended.',
-            'patient': 'Your eyes look healthy. Come back for another screening in 1 year.',
-            'urgency': 'routine'
-        },
-        1: {  # Mild
-            'nurse': 'Mild diabetic retinopathy detected. Recommend follow-up in 6-12 months.',
-            'patient': 'Early signs detected. See an eye doctor within 6-12 months to monitor your eyes.',
-            'urgency': 'monitor'
-        },
-        2: {  # Moderate
-            'nurse': 'Moderate diabetic retinopathy. Refer to eye specialist within 3-6 months.',
-            'patient': 'Your eyes need attention. See an eye doctor within 3-6 months for treatment.',
-            'urgency': 'refer'
-        },
-        3: {  # Severe
-            'nurse': 'Severe diabetic retinopathy. Urgent referral to eye specialist within 1-2 months.',
-            'patient': 'Your eyes need urgent care. See an eye doctor within 1-2 months. Treatment can protect your vision.',
-            'urgency': 'urgent'
-        },
-        4: {  # Proliferative DR
-            'nurse': 'Proliferative diabetic retinopathy. Immediate referral to eye specialist (within 2 weeks).',
-            'patient': 'Your eyes need immediate attention. See an eye doctor within 2 weeks. Early treatment is very important.',
-            'urgency': 'immediate'
-        }
-    }
-    
-    recommendation = recommendations.get(predicted_class, recommendations[0])
+    # Copy so the confidence note doesn't leak into the shared table
+    recommendation = dict(_RECOMMENDATIONS.get(predicted_class, _RECOMMENDATIONS[0]))
     
     # Add confidence note
     if confidence < 0.7:
@@ -181,15 +894,8 @@ def interpret_prediction_simple(prediction):
     # Convert confidence to percentage
     confidence_pct = int(confidence * 100)
     
-    explanations = {
-        0: f"Good news! The screening tool did not find signs of eye disease. The computer is {confidence_pct}% sure about this result.",
-        1: f"The screening found early signs of eye disease. The computer is {confidence_pct}% sure. This means your eyes need to be checked again soon.",
-        2: f"The screening found signs of eye disease that need attention. The computer is {confidence_pct}% sure. An eye doctor should examine your eyes within a few months.",
-        3: f"The screening found serious signs of eye disease. The computer is {confidence_pct}% sure. You need to see an eye doctor soon for treatment.",
-        4: f"The screening found advanced eye disease. The computer is {confidence_pct}% sure. It's very important to see an eye doctor right away for treatment."
-    }
-    
-    explanation = explanations.get(predicted_class, explanations[0])
+    prefix, suffix = _EXPLANATIONS.get(predicted_class, _EXPLANATIONS[0])
+    explanation = f"{prefix}{confidence_pct}{suffix}"
     
     # Add confidence warning if needed
     if confidence < 0.7:
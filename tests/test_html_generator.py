@@ -0,0 +1,29 @@
+"""
+Tests for HTML report template loading
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from html_generator import _load_template
+
+
+class LoadTemplateTest(unittest.TestCase):
+    
+    def test_legacy_markers_keep_their_names_and_literal_dollars(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'report.html')
+            with open(path, 'w') as f:
+                f.write('<p>{{PATIENT_ID}}x costs $5 on {{SCREENING_DATE}}_today</p>')
+            
+            html = _load_template(path).substitute(PATIENT_ID='P1', SCREENING_DATE='Monday')
+        
+        self.assertEqual(html, '<p>P1x costs $5 on Monday_today</p>')
+
+
+if __name__ == '__main__':
+    unittest.main()